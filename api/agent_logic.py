@@ -1,179 +1,500 @@
 import os
 import re
+import signal
+import sqlite3
 import subprocess
+import tempfile
+import threading
+import hashlib
+import multiprocessing
 import json
 import time
+from collections import defaultdict, deque
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import accumulate
 from typing import List, Dict, Tuple, Optional
 
+# Comprehensive bug patterns for detection, compiled once at import
+_BUG_PATTERNS = {
+    'LINTING': [
+        (r"^import ['\"]os['\"]", "Unused standard library import"),
+        (r"^from os import", "Unused standard library import"),
+        (r"^import ['\"]sys['\"]", "Unused standard library import"),
+        (r"^import ['\"]numpy['\"]", "Unused standard library import"),
+        (r"^import ['\"]pandas['\"]", "Unused standard library import"),
+        (r"print\(.+\)", "Debug print statement found"),
+        (r"^import ['\"]math['\"]", "Unused standard library import"),
+        (r"^import ['\"]random['\"]", "Unused standard library import"),
+    ],
+    'SYNTAX': [
+        # Missing colon after function definition - FIXED regex
+        (r"^\s*def\s+[a-zA-Z_][a-zA-Z0-9_]*\s*\([^)]*\)\s*$", "Missing colon after function definition"),
+        (r"^\s*class\s+[a-zA-Z_][a-zA-Z0-9_]*\s*$", "Missing colon after class definition"),
+        (r"^\s*if\s+.*\s*$", "Missing colon after if statement"),
+        (r"^\s*elif\s+.*\s*$", "Missing colon after elif statement"),
+        (r"^\s*else\s*$", "Missing colon after else statement"),
+        (r"^\s*for\s+.*\s*$", "Missing colon after for statement"),
+        (r"^\s*while\s+.*\s*$", "Missing colon after while statement"),
+        (r"^\s*try\s*$", "Missing colon after try statement"),
+        (r"^\s*except\s+.*\s*$", "Missing colon after except statement"),
+        (r"^\s*finally\s*$", "Missing colon after finally statement"),
+        (r"^\s*with\s+.*\s*$", "Missing colon after with statement"),
+        (r"^\s*async def\s+[a-zA-Z_][a-zA-Z0-9_]*\s*\([^)]*\)\s*$", "Missing colon after async function"),
+        # Unmatched brackets and parentheses
+        (r"[^#]*\(\s*\)[^#]*$", "Empty parentheses"),
+        (r"[^#]*\[\s*\][^#]*$", "Empty brackets"),
+        (r"[^#]*\{\s*\}[^#]*$", "Empty braces"),
+    ],
+    'TYPE_ERROR': [
+        (r"for\s+\w+\s+in\s+\w+\s+for\s+", "Confused list comprehension"),
+    ],
+    'INDENTATION': [
+        (r"^\t", "Tab indentation found (use spaces)"),
+        (r"    \t", "Mixed tab and space indentation"),
+    ],
+    'IMPORT': [
+        (r"^import\s*$", "Incomplete import statement"),
+        (r"^from\s+.*import\s*$", "Incomplete from import"),
+    ]
+}
+
+
+def _single_line(pattern: str) -> str:
+    """Rewrite \\s as [^\\S\\n] so a whole-file MULTILINE scan never matches across lines"""
+    return pattern.replace(r"\s", r"[^\S\n]")
+
+
+# One regex per pattern, each run once over the whole file. They are kept
+# separate rather than fused into one alternation per type: an alternation
+# loses the literal-prefix search re uses for unanchored patterns such as
+# print\(.+\), which made the fused scan about three times slower.
+# SYNTAX and INDENTATION are checked separately in analyze_file.
+# Compiled as bytes patterns: files are scanned undecoded.
+_LINE_PATTERNS = {
+    bug_type: [(re.compile(_single_line(pattern).encode(), re.MULTILINE), pattern, description) for pattern, description in patterns]
+    for bug_type, patterns in _BUG_PATTERNS.items()
+    if bug_type not in ['SYNTAX', 'INDENTATION']
+}
+_TAB_REGEX = re.compile(rb"^\t", re.MULTILINE)
+# Statement prefixes that must end with a colon, as one anchored regex.
+# Leading whitespace is matched with [^\S\n] so a match never starts on an
+# earlier blank line.
+_COLON_KEYWORDS = ('def ', 'class ', 'if ', 'elif ', 'else:', 'for ', 'while ', 'try:', 'except ', 'finally:', 'with ', 'async def ')
+_COLON_REGEX = re.compile(rb"^[^\S\n]*(" + b"|".join(re.escape(keyword.encode()) for keyword in _COLON_KEYWORDS) + rb")", re.MULTILINE)
+
+
+def _comment_start(line: str) -> int:
+    """Index of the '#' that starts a comment on a line of Python, or -1;
+    a '#' inside a string literal doesn't count"""
+    hash_idx = line.find('#')
+    if hash_idx < 0:
+        return -1
+    if '"' not in line[:hash_idx] and "'" not in line[:hash_idx]:
+        return hash_idx
+    
+    quote = None
+    escaped = False
+    for idx, char in enumerate(line):
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '#':
+            return idx
+    return -1
+
+
+# On-disk cache of scan results keyed by file content, so files that haven't
+# changed are not rescanned across runs and processes. AGENT_ANALYSIS_CACHE
+# overrides the file; empty disables it. The default lives in a private
+# per-user directory, never at a predictable path in the shared temp dir,
+# where another local user could plant rows that are replayed as bugs.
+_ANALYSIS_DB_PATH = os.environ.get("AGENT_ANALYSIS_CACHE")
+# Rows beyond this many are pruned oldest first, on open and every
+# _ANALYSIS_DB_PRUNE_EVERY saves
+_ANALYSIS_DB_MAX_ROWS = 50000
+_ANALYSIS_DB_PRUNE_EVERY = 1000
+# Part of every key, so editing the checks never reuses stale results
+_ANALYSIS_KEY_SALT = repr((_BUG_PATTERNS, [regex.pattern for patterns in _LINE_PATTERNS.values() for regex, _, _ in patterns], _COLON_KEYWORDS)).encode()
+_analysis_db = None
+_analysis_db_pid = None
+_analysis_db_lock = threading.Lock()
+_analysis_db_saves = 0
+
+
+def _content_digest(data: bytes) -> str:
+    digest = hashlib.blake2b(_ANALYSIS_KEY_SALT, digest_size=16)
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def _analysis_db_path() -> str:
+    """AGENT_ANALYSIS_CACHE, else analysis.sqlite3 in a directory only this user can open"""
+    if _ANALYSIS_DB_PATH is not None:
+        return _ANALYSIS_DB_PATH
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    directory = os.path.join(cache_home, "devops-agent")
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if not os.access(directory, os.W_OK):
+            raise OSError(f"{directory} is not writable")
+    except OSError:
+        # Read-only home (serverless runtimes): a private directory for this process
+        directory = tempfile.mkdtemp(prefix="devops-agent-")
+    return os.path.join(directory, "analysis.sqlite3")
+
+
+def _prune_analysis_db(conn: sqlite3.Connection):
+    """Drop the oldest rows beyond _ANALYSIS_DB_MAX_ROWS; rowids grow with insertion order"""
+    conn.execute(
+        "DELETE FROM analysis WHERE rowid <= (SELECT max(rowid) FROM analysis) - ?",
+        (_ANALYSIS_DB_MAX_ROWS,)
+    )
+
+
+def _analysis_db_conn() -> Optional[sqlite3.Connection]:
+    """This process's cache connection (reopened after a fork), or None if the cache is off or unusable"""
+    global _analysis_db, _analysis_db_pid
+    if _ANALYSIS_DB_PATH == "":
+        return None
+    if _analysis_db_pid != os.getpid():
+        _analysis_db_pid = os.getpid()
+        _analysis_db = None
+        try:
+            path = _analysis_db_path()
+            # Created owner-only before SQLite opens it; the WAL and shm files
+            # take the same mode
+            os.close(os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600))
+            conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS analysis (digest TEXT PRIMARY KEY, bugs TEXT NOT NULL)")
+            _prune_analysis_db(conn)
+            _analysis_db = conn
+        except (OSError, sqlite3.Error) as e:
+            print(f"Analysis cache unavailable: {e}")
+    return _analysis_db
+
+
+def _load_scan(digest: str) -> Optional[list]:
+    """Cached [line, content, type, description, pattern] rows for a file digest"""
+    with _analysis_db_lock:
+        conn = _analysis_db_conn()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute("SELECT bugs FROM analysis WHERE digest = ?", (digest,)).fetchone()
+        except sqlite3.Error:
+            return None
+    return json.loads(row[0]) if row else None
+
+
+def _save_scan(digest: str, bugs: List['Bug']):
+    global _analysis_db_saves
+    rows = json.dumps([[bug.line, bug.content, bug.type, bug.description, bug.pattern] for bug in bugs])
+    with _analysis_db_lock:
+        conn = _analysis_db_conn()
+        if conn is None:
+            return
+        try:
+            conn.execute("INSERT OR IGNORE INTO analysis (digest, bugs) VALUES (?, ?)", (digest, rows))
+            _analysis_db_saves += 1
+            if _analysis_db_saves % _ANALYSIS_DB_PRUNE_EVERY == 0:
+                _prune_analysis_db(conn)
+        except sqlite3.Error:
+            pass
+
+
+@dataclass
+class Bug:
+    """A single issue found by analyze_file"""
+    # Explicit __slots__ rather than dataclass(slots=True), which needs Python 3.10
+    __slots__ = ('file', 'line', 'content', 'type', 'description', 'pattern')
+    file: str
+    line: int
+    content: str
+    type: str
+    description: str
+    pattern: str
+
+
 class CodeAgent:
+    # Directories the agent never descends into
+    SKIP_DIRS = ['node_modules', '.git', '__pycache__', 'venv', '.venv', 'dist', 'build', '.idea']
+    # Below this many bytes to scan the process pool costs more to start
+    # (~185 ms for forkserver workers) than it saves; scanning runs at about
+    # 13 MB/s per process
+    PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+    # Files the bug patterns apply to; they only describe Python constructs
+    ANALYZED_EXTENSIONS = ('.py',)
+    # Lines of test runner output kept from the end of each command
+    OUTPUT_TAIL_LINES = 2000
+
+    @classmethod
+    def sparse_paths(cls) -> List[str]:
+        """Non-cone sparse-checkout patterns: the whole tree except SKIP_DIRS
+        
+        run_tests needs config and data files (setup.cfg, fixtures, lockfiles)
+        as well as code, so only the directories discover_files skips anyway
+        are left out.
+        """
+        return ['/*'] + [f"!{d}/" for d in sorted(cls.SKIP_DIRS)]
+
     def __init__(self, repo_path: str, github_token: str = ""):
         self.repo_path = repo_path
         self.github_token = github_token
         self.fixes_applied = []
         self.cicd_runs = []
+        # Repository layout, probed once: fixes only edit lines, never add or remove files
+        self._root_names = None
+        self._language = None
+        # file path -> ((mtime_ns, size), bugs) from the last scan of that file
+        self._analysis_cache = {}
         
-        # Comprehensive bug patterns for detection
-        self.bug_patterns = {
-            'LINTING': [
-                (r"^import ['\"]os['\"]", "Unused standard library import"),
-                (r"^from os import", "Unused standard library import"),
-                (r"^import ['\"]sys['\"]", "Unused standard library import"),
-                (r"^import ['\"]numpy['\"]", "Unused standard library import"),
-                (r"^import ['\"]pandas['\"]", "Unused standard library import"),
-                (r"print\(.+\)", "Debug print statement found"),
-                (r"^import ['\"]math['\"]", "Unused standard library import"),
-                (r"^import ['\"]random['\"]", "Unused standard library import"),
-            ],
-            'SYNTAX': [
-                # Missing colon after function definition - FIXED regex
-                (r"^\s*def\s+[a-zA-Z_][a-zA-Z0-9_]*\s*\([^)]*\)\s*$", "Missing colon after function definition"),
-                (r"^\s*class\s+[a-zA-Z_][a-zA-Z0-9_]*\s*$", "Missing colon after class definition"),
-                (r"^\s*if\s+.*\s*$", "Missing colon after if statement"),
-                (r"^\s*elif\s+.*\s*$", "Missing colon after elif statement"),
-                (r"^\s*else\s*$", "Missing colon after else statement"),
-                (r"^\s*for\s+.*\s*$", "Missing colon after for statement"),
-                (r"^\s*while\s+.*\s*$", "Missing colon after while statement"),
-                (r"^\s*try\s*$", "Missing colon after try statement"),
-                (r"^\s*except\s+.*\s*$", "Missing colon after except statement"),
-                (r"^\s*finally\s*$", "Missing colon after finally statement"),
-                (r"^\s*with\s+.*\s*$", "Missing colon after with statement"),
-                (r"^\s*async def\s+[a-zA-Z_][a-zA-Z0-9_]*\s*\([^)]*\)\s*$", "Missing colon after async function"),
-                # Unmatched brackets and parentheses
-                (r"[^#]*\(\s*\)[^#]*$", "Empty parentheses"),
-                (r"[^#]*\[\s*\][^#]*$", "Empty brackets"),
-                (r"[^#]*\{\s*\}[^#]*$", "Empty braces"),
-            ],
-            'TYPE_ERROR': [
-                (r"for\s+\w+\s+in\s+\w+\s+for\s+", "Confused list comprehension"),
-            ],
-            'INDENTATION': [
-                (r"^\t", "Tab indentation found (use spaces)"),
-                (r"    \t", "Mixed tab and space indentation"),
-            ],
-            'IMPORT': [
-                (r"^import\s*$", "Incomplete import statement"),
-                (r"^from\s+.*import\s*$", "Incomplete from import"),
-            ]
-        }
+        # Shared, precompiled patterns (see module level)
+        self.bug_patterns = _BUG_PATTERNS
+        self._line_patterns = _LINE_PATTERNS
+        self._tab_regex = _TAB_REGEX
+        self._colon_regex = _COLON_REGEX
 
     def run_command(self, cmd, cwd=None):
-        """Cross-platform command execution"""
+        """Cross-platform command execution; output is streamed and only the
+        last OUTPUT_TAIL_LINES lines (stderr merged into stdout) are kept"""
         try:
-            result = subprocess.run(
+            proc = subprocess.Popen(
                 cmd,
                 shell=True,
                 cwd=cwd or self.repo_path,
-                capture_output=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
                 text=True,
-                timeout=120
+                encoding='utf-8',
+                errors='replace',
+                start_new_session=True  # lets a timeout kill the test runner, not just the shell
             )
-            return result
         except Exception as e:
             print(f"Command error: {e}")
             return None
+        
+        timed_out = threading.Event()
+        
+        def kill():
+            timed_out.set()
+            try:
+                if hasattr(os, 'killpg'):
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    proc.kill()
+            except OSError:
+                pass
+        
+        timer = threading.Timer(120, kill)
+        timer.start()
+        try:
+            tail = deque(proc.stdout, maxlen=self.OUTPUT_TAIL_LINES)
+            returncode = proc.wait()
+        finally:
+            timer.cancel()
+            proc.stdout.close()
+        
+        if timed_out.is_set():
+            print(f"Command error: '{cmd}' timed out after 120 seconds")
+            return None
+        return subprocess.CompletedProcess(cmd, returncode, stdout="".join(tail), stderr="")
 
     def discover_files(self) -> List[str]:
-        """Discover all code files in the repository"""
+        """Discover all files in the repository the bug patterns apply to"""
         code_files = []
-        extensions = {'.py', '.js', '.ts', '.jsx', '.tsx', '.java', '.go', '.rs', '.c', '.cpp', '.h'}
+        
+        extensions = self.ANALYZED_EXTENSIONS
         
         try:
-            for root, dirs, files in os.walk(self.repo_path):
-                dirs[:] = [d for d in dirs if d not in ['node_modules', '.git', '__pycache__', 'venv', '.venv', 'dist', 'build', '.idea']]
-                
-                for file in files:
-                    if any(file.endswith(ext) for ext in extensions):
-                        full_path = os.path.join(root, file)
-                        try:
-                            with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
-                                f.read(1)
-                            code_files.append(full_path)
-                        except Exception:
-                            pass
+            # Iterative scandir walk: entry types come from the directory
+            # listing itself, so there is no extra stat per entry
+            stack = [self.repo_path]
+            while stack:
+                try:
+                    with os.scandir(stack.pop()) as entries:
+                        subdirs = []
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name not in self.SKIP_DIRS:
+                                    subdirs.append(entry.path)
+                            elif entry.name.endswith(extensions):
+                                # No readability probe: analyze_file already copes with unreadable files
+                                code_files.append(entry.path)
+                except OSError:
+                    continue  # unreadable directory, as os.walk would skip it
+                # Reversed so directories are visited in listing order, like os.walk
+                stack.extend(reversed(subdirs))
         except Exception as e:
             print(f"Error discovering files: {e}")
         
         return code_files
 
-    def analyze_file(self, file_path: str) -> List[Dict]:
-        """Analyze a single file for bugs"""
+    def analyze_file(self, file_path: str) -> List['Bug']:
+        """Analyze a single file for bugs, reusing the last result while the file is unchanged"""
+        stamp, bugs = self._cached_analysis(file_path)
+        if bugs is None:
+            bugs = self._scan_file(file_path)
+            self._store_analysis(file_path, stamp, bugs)
+        return list(bugs)
+
+    def _cached_analysis(self, file_path: str) -> Tuple[Optional[Tuple[int, int]], Optional[List['Bug']]]:
+        """(mtime/size stamp, cached bugs or None) for a file; the stamp is None if it can't be stat'ed"""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None, None
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._analysis_cache.get(file_path)
+        if cached is not None and cached[0] == stamp:
+            return stamp, cached[1]
+        return stamp, None
+
+    def _store_analysis(self, file_path: str, stamp: Optional[Tuple[int, int]], bugs: List['Bug']):
+        if stamp is not None:
+            self._analysis_cache[file_path] = (stamp, bugs)
+
+    def _scan_file(self, file_path: str) -> List['Bug']:
+        """Run every check over one file"""
         bugs = []
-        rel_path = os.path.relpath(file_path, self.repo_path)
+        if not file_path.endswith(self.ANALYZED_EXTENSIONS):
+            return bugs
         
-        # Keywords that require a colon at the end
-        colon_keywords = ['def ', 'class ', 'if ', 'elif ', 'else:', 'for ', 'while ', 'try:', 'except ', 'finally:', 'with ', 'async def ']
+        seen = set()  # (line_num, bug_type) already reported
+        rel_path = os.path.relpath(file_path, self.repo_path)
         
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
+            # Scanned as raw bytes; only the lines that get reported are decoded
+            with open(file_path, 'rb') as f:
+                data = f.read()
             
-            for line_num, line in enumerate(lines, 1):
-                # Skip empty lines and pure comments
-                stripped = line.strip()
-                if not stripped or stripped.startswith('#'):
-                    continue
-                
-                # Check for missing colon after statements
-                for keyword in colon_keywords:
-                    if line.startswith(keyword) or line.lstrip().startswith(keyword):
-                        # Line starts with a keyword that needs a colon
-                        # Check if line ends with a colon (but not in a string or comment)
-                        if not line.rstrip().endswith(':') and '#' not in line:
-                            # This is a potential missing colon bug
-                            existing = [b for b in bugs if b['line'] == line_num and b['type'] == 'SYNTAX']
-                            if not existing:
-                                bugs.append({
-                                    'file': rel_path,
-                                    'line': line_num,
-                                    'content': line.strip(),
-                                    'type': 'SYNTAX',
-                                    'description': f"Missing colon after {keyword.strip()} statement",
-                                    'pattern': f"missing_colon_{keyword.strip()}"
-                                })
-                
-                # Check for tab indentation
-                if line.startswith('\t'):
-                    existing = [b for b in bugs if b['line'] == line_num and b['type'] == 'INDENTATION']
-                    if not existing:
-                        bugs.append({
-                            'file': rel_path,
-                            'line': line_num,
-                            'content': line.strip(),
-                            'type': 'INDENTATION',
-                            'description': "Tab indentation found (use spaces)",
-                            'pattern': "tab_indent"
-                        })
-                
-                # Check for other patterns from bug_patterns
-                for bug_type, patterns in self.bug_patterns.items():
-                    if bug_type in ['SYNTAX', 'INDENTATION']:
-                        continue  # Already handled above
-                    
-                    for pattern, description in patterns:
-                        if re.search(pattern, line):
-                            # Avoid duplicate reports
-                            existing = [b for b in bugs if b['line'] == line_num and b['type'] == bug_type]
-                            if not existing:
-                                bugs.append({
-                                    'file': rel_path,
-                                    'line': line_num,
-                                    'content': line.strip(),
-                                    'type': bug_type,
-                                    'description': description,
-                                    'pattern': pattern
-                                })
+            # Identical content scans identically, whatever the file is called
+            digest = _content_digest(data)
+            cached = _load_scan(digest)
+            if cached is not None:
+                return [Bug(rel_path, *row) for row in cached]
+            
+            lines = data.split(b'\n')
+            # Offset at which each line starts, to map regex matches back to line numbers
+            line_starts = list(accumulate((len(line) + 1 for line in lines), initial=0))
+            
+            # Every check runs its regex once over the whole file
+            
+            # Check for missing colon after statements
+            for line_num, line, match in self._find_in_lines(self._colon_regex, data, lines, line_starts):
+                # Lines with a trailing comment are left alone, since the fix
+                # appends the colon at the very end
+                if not line.rstrip().endswith(':') and _comment_start(line) < 0:
+                    keyword = match.group(1).decode().strip()
+                    seen.add((line_num, 'SYNTAX'))
+                    bugs.append(Bug(
+                        file=rel_path,
+                        line=line_num,
+                        content=line.strip(),
+                        type='SYNTAX',
+                        description=f"Missing colon after {keyword} statement",
+                        pattern=f"missing_colon_{keyword}"
+                    ))
+            
+            # Check for tab indentation
+            for line_num, line, _ in self._find_in_lines(self._tab_regex, data, lines, line_starts):
+                if (line_num, 'INDENTATION') not in seen:
+                    seen.add((line_num, 'INDENTATION'))
+                    bugs.append(Bug(
+                        file=rel_path,
+                        line=line_num,
+                        content=line.strip(),
+                        type='INDENTATION',
+                        description="Tab indentation found (use spaces)",
+                        pattern="tab_indent"
+                    ))
+            
+            # Check for other patterns from bug_patterns
+            # Patterns run in list order, so the first one matching a line is reported
+            for bug_type, patterns in self._line_patterns.items():
+                for regex, pattern, description in patterns:
+                    for line_num, line, _ in self._find_in_lines(regex, data, lines, line_starts):
+                        # Avoid duplicate reports
+                        if (line_num, bug_type) in seen:
+                            continue
+                        seen.add((line_num, bug_type))
+                        bugs.append(Bug(
+                            file=rel_path,
+                            line=line_num,
+                            content=line.strip(),
+                            type=bug_type,
+                            description=description,
+                            pattern=pattern
+                        ))
+            
+            # Report in line order, as the per-line scan did
+            bugs.sort(key=lambda b: b.line)
+            _save_scan(digest, bugs)
         except Exception as e:
             print(f"Error analyzing {file_path}: {e}")
         
         return bugs
 
-    def generate_fix(self, bug: Dict) -> Tuple[str, str]:
+    def _find_in_lines(self, regex, data: bytes, lines: List[bytes], line_starts: List[int]):
+        """Yield (line_num, decoded line, match) for matches of a MULTILINE bytes
+        regex over the whole file, skipping empty lines and pure comments"""
+        for match in regex.finditer(data):
+            line_idx = bisect_right(line_starts, match.start()) - 1
+            stripped = lines[line_idx].strip()
+            if stripped and not stripped.startswith(b'#'):
+                yield line_idx + 1, lines[line_idx].decode('utf-8', 'ignore'), match
+
+    def analyze_files(self, files: List[str]) -> List['Bug']:
+        """Analyze files, rescanning only those changed since the last call and
+        spreading larger batches across processes"""
+        results = {}
+        pending = []
+        for file_path in files:
+            stamp, bugs = self._cached_analysis(file_path)
+            if bugs is None:
+                pending.append((file_path, stamp))
+            else:
+                results[file_path] = bugs
+        
+        scanned = None
+        # A single CPU (as on serverless runtimes) never gains from the pool
+        workers = min(os.cpu_count() or 1, 32)
+        pending_bytes = sum(stamp[1] for _, stamp in pending if stamp is not None)
+        if workers > 1 and pending_bytes >= self.PARALLEL_MIN_BYTES:
+            try:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=_POOL_CONTEXT) as pool:
+                    jobs = [(self.repo_path, file_path) for file_path, _ in pending]
+                    scanned = list(pool.map(_analyze_file_worker, jobs, chunksize=16))
+            except Exception as e:
+                # e.g. no /dev/shm for multiprocessing on serverless runtimes
+                print(f"Parallel analysis unavailable, running sequentially: {e}")
+        if scanned is None:
+            scanned = [self._scan_file(file_path) for file_path, _ in pending]
+        
+        for (file_path, stamp), bugs in zip(pending, scanned):
+            self._store_analysis(file_path, stamp, bugs)
+            results[file_path] = bugs
+        
+        all_bugs = []
+        for file_path in files:
+            all_bugs.extend(results[file_path])
+        return all_bugs
+
+    def generate_fix(self, bug: 'Bug') -> Tuple[str, str]:
         """Generate a fix for a detected bug"""
-        line_content = bug['content']
-        bug_type = bug['type']
+        line_content = bug.content
+        bug_type = bug.type
         
         if bug_type == 'LINTING':
-            return "", f"remove the {bug['description'].lower()}"
+            return "", f"remove the {bug.description.lower()}"
         
         elif bug_type == 'SYNTAX':
             fixed_line = line_content + ':'
@@ -187,57 +508,76 @@ class CodeAgent:
         
         return line_content, "manual review required"
 
-    def apply_fix(self, bug: Dict, fix_content: str) -> bool:
-        """Apply a fix to the file"""
-        file_path = os.path.join(self.repo_path, bug['file'])
+    def _root_entries(self) -> set:
+        """Names of the entries at the repository root, listed once per agent"""
+        if self._root_names is None:
+            try:
+                self._root_names = set(os.listdir(self.repo_path))
+            except OSError:
+                self._root_names = set()
+        return self._root_names
+
+    def apply_fixes_bulk(self, fixes_by_file: Dict[str, List[Tuple['Bug', str]]]) -> Dict[str, bool]:
+        """Apply all fixes for each file in a single read and write; returns success per file"""
+        results = {}
         
-        try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
-            
-            line_idx = bug['line'] - 1
-            if fix_content == "":
-                lines[line_idx] = ""
-            else:
-                lines[line_idx] = fix_content + '\n'
-            
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.writelines(lines)
-            
-            return True
-        except Exception as e:
-            print(f"Failed to apply fix: {e}")
-            return False
+        for rel_path, fixes in fixes_by_file.items():
+            file_path = os.path.join(self.repo_path, rel_path)
+            try:
+                # newline='\n' splits on '\n' only and translates nothing, so line
+                # numbers agree with _scan_file even for files with lone '\r's
+                with open(file_path, 'r', encoding='utf-8', errors='ignore', newline='\n') as f:
+                    lines = f.readlines()
+                
+                for bug, fix_content in fixes:
+                    line_idx = bug.line - 1
+                    if fix_content == "":
+                        lines[line_idx] = ""
+                    else:
+                        # Keep the line's own ending so CRLF files stay CRLF
+                        ending = '\r\n' if lines[line_idx].endswith('\r\n') else '\n'
+                        lines[line_idx] = fix_content + ending
+                
+                with open(file_path, 'w', encoding='utf-8', newline='\n') as f:
+                    f.writelines(lines)
+                # Don't trust the mtime alone: a same-size rewrite can land in the same tick
+                self._analysis_cache.pop(file_path, None)
+                
+                results[rel_path] = True
+            except Exception as e:
+                print(f"Failed to apply fixes to {rel_path}: {e}")
+                results[rel_path] = False
+        
+        return results
 
     def detect_language(self) -> str:
         """Detect the programming language of the repository"""
-        # Check for common files
-        if os.path.exists(os.path.join(self.repo_path, "package.json")):
-            return "JavaScript/TypeScript"
-        elif os.path.exists(os.path.join(self.repo_path, "requirements.txt")) or \
-             os.path.exists(os.path.join(self.repo_path, "setup.py")) or \
-             os.path.exists(os.path.join(self.repo_path, "pyproject.toml")):
-            return "Python"
-        elif os.path.exists(os.path.join(self.repo_path, "pom.xml")):
-            return "Java"
-        elif os.path.exists(os.path.join(self.repo_path, "go.mod")):
-            return "Go"
-        elif os.path.exists(os.path.join(self.repo_path, "Cargo.toml")):
-            return "Rust"
-        return "Unknown"
+        if self._language is None:
+            # Check for common files
+            names = self._root_entries()
+            if "package.json" in names:
+                self._language = "JavaScript/TypeScript"
+            elif names & {"requirements.txt", "setup.py", "pyproject.toml"}:
+                self._language = "Python"
+            elif "pom.xml" in names:
+                self._language = "Java"
+            elif "go.mod" in names:
+                self._language = "Go"
+            elif "Cargo.toml" in names:
+                self._language = "Rust"
+            else:
+                self._language = "Unknown"
+        return self._language
 
     def run_tests(self) -> Tuple[bool, str]:
         """Run tests and return pass/fail with output"""
         lang = self.detect_language()
+        names = self._root_entries()
         
         # Python tests
         if lang == "Python":
             # Check for pytest
-            if os.path.exists(os.path.join(self.repo_path, "pytest.ini")) or \
-               os.path.exists(os.path.join(self.repo_path, "setup.py")) or \
-               os.path.exists(os.path.join(self.repo_path, "pyproject.toml")) or \
-               os.path.exists(os.path.join(self.repo_path, "tests")) or \
-               os.path.exists(os.path.join(self.repo_path, "test")):
+            if names & {"pytest.ini", "setup.py", "pyproject.toml", "tests", "test"}:
                 result = self.run_command("python -m pytest -v --tb=short 2>&1")
                 if result:
                     if result.returncode == 0:
@@ -253,7 +593,7 @@ class CodeAgent:
         
         # JavaScript/Node tests
         elif lang == "JavaScript/TypeScript":
-            if os.path.exists(os.path.join(self.repo_path, "package.json")):
+            if "package.json" in names:
                 result = self.run_command("npm test -- --passWithNoTests 2>&1")
                 if result:
                     if result.returncode == 0:
@@ -291,21 +631,8 @@ class CodeAgent:
             files = self.discover_files()
             print(f"Analyzing {len(files)} files...")
             
-            current_bugs = []
-            for file_path in files:
-                bugs = self.analyze_file(file_path)
-                current_bugs.extend(bugs)
-            
-            # Remove duplicates from current bugs
-            unique_current_bugs = []
-            seen = set()
-            for bug in current_bugs:
-                key = (bug['file'], bug['line'], bug['type'])
-                if key not in seen:
-                    seen.add(key)
-                    unique_current_bugs.append(bug)
-            
-            current_bugs = unique_current_bugs
+            # analyze_file reports each (line, type) once per file, so no dedupe pass is needed
+            current_bugs = self.analyze_files(files)
             
             if not current_bugs:
                 print("✓ No bugs found. Running CI/CD tests...")
@@ -329,27 +656,37 @@ class CodeAgent:
             print(f"Found {len(current_bugs)} bugs to fix")
             all_bugs_found.extend(current_bugs)
             
-            # 2. Apply fixes
+            # 2. Apply fixes, rewriting each file once
+            generated = [(bug, *self.generate_fix(bug)) for bug in current_bugs]
+            fixes_by_file = defaultdict(list)
+            for bug, fix_content, _ in generated:
+                fixes_by_file[bug.file].append((bug, fix_content))
+            file_results = self.apply_fixes_bulk(fixes_by_file)
+            
             fixed_count = 0
-            for bug in current_bugs:
-                fix_content, fix_desc = self.generate_fix(bug)
-                success = self.apply_fix(bug, fix_content)
+            for bug, fix_content, fix_desc in generated:
+                success = file_results[bug.file]
                 
                 if success:
                     fixed_count += 1
                 
                 self.fixes_applied.append({
-                    'file': bug['file'],
-                    'bug_type': bug['type'],
-                    'line_number': bug['line'],
-                    'content': bug['content'],
-                    'commit_message': f"[AI-AGENT] Fix {bug['type']} in {os.path.basename(bug['file'])} line {bug['line']}",
+                    'file': bug.file,
+                    'bug_type': bug.type,
+                    'line_number': bug.line,
+                    'content': bug.content,
+                    'commit_message': f"[AI-AGENT] Fix {bug.type} in {os.path.basename(bug.file)} line {bug.line}",
                     'status': 'Fixed' if success else 'Failed',
                     'fix_detail': fix_desc
                 })
             
             print(f"Applied {fixed_count}/{len(current_bugs)} fixes")
             
+            if not current_bugs:
+                # Tests already failed above and there is nothing to fix
+                print("No progress; stopping early")
+                break
+            
             # 3. Run CI/CD tests after fixes
             print("Running CI/CD tests...")
             tests_passed, test_output = self.run_tests()
@@ -364,15 +701,40 @@ class CodeAgent:
                 self.cicd_runs[-1]['status'] = 'FAILED'
                 self.cicd_runs[-1]['tests_passed'] = False
                 self.cicd_runs[-1]['errors'].append(test_output)
+            
+            if fixed_count == 0:
+                # Nothing changed, so another iteration would find the same bugs
+                print("No progress; stopping early")
+                break
         
         return {
             'total_iterations': iteration,
             'fixes': self.fixes_applied,
             'cicd_runs': self.cicd_runs,
-            'unique_bugs': len(set([(b['file'], b['line'], b['type']) for b in all_bugs_found]))
+            'unique_bugs': len(set([(b.file, b.line, b.type) for b in all_bugs_found]))
         }
 
 
+# Pool workers are never forked from the (multithreaded) server process: a
+# child forked while another thread holds the cache, logging or SQLite locks
+# would inherit them locked forever. forkserver forks from a clean helper
+# process; spawn is the fallback where it is unavailable (Windows).
+_POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+# Per-process agents for the analysis pool, keyed by repository path
+_worker_agents = {}
+
+def _analyze_file_worker(job: Tuple[str, str]) -> List['Bug']:
+    """Process pool entry point: analyze one file with this process's agent"""
+    repo_path, file_path = job
+    agent = _worker_agents.get(repo_path)
+    if agent is None:
+        agent = _worker_agents[repo_path] = CodeAgent(repo_path)
+    return agent._scan_file(file_path)
+
+
 # Factory function for importing
 def get_agent(repo_path: str) -> 'CodeAgent':
     return CodeAgent(repo_path)
\ No newline at end of file
@@ -1,34 +1,81 @@
 import os
 import re
+import asyncio
+import functools
 import subprocess
 import time
-import json
 import shutil
 import zipfile
-import urllib.request
+import tempfile
+import base64
 import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import certifi
+import httpx
+import orjson
+try:
+    import fcntl
+except ImportError:  # Windows - mirror fetches are not serialized across processes
+    fcntl = None
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 
 # Import the agent logic
 from agent_logic import CodeAgent
 
-app = FastAPI(title="DevOps Agent API")
+app = FastAPI(title="DevOps Agent API", default_response_class=ORJSONResponse)
+
+# Log records are queued by request handlers and written by a listener thread,
+# so slow stdout/stderr writes never block the event loop
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+
+logger = logging.getLogger("devops-agent")
+logger.addHandler(QueueHandler(_log_queue))
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+
+# One verifying SSL context per process - the CA bundle is loaded once at import
+_SSL_CTX = ssl.create_default_context(cafile=certifi.where())
+
+# Shared connection pool for GitHub REST calls - reused across requests so the
+# TLS handshake to api.github.com is paid once per warm instance
+_GH_POOL = httpx.Client(
+    headers={'Accept': 'application/vnd.github.v3+json'},
+    verify=_SSL_CTX,
+    limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+    timeout=5
+)
+
+def _gh_request(method, url, payload=None, **kwargs):
+    """Send a request over the shared pool with an orjson-encoded JSON body"""
+    if payload is not None:
+        kwargs['content'] = orjson.dumps(payload)
+        kwargs['headers'] = {**kwargs.get('headers', {}), 'Content-Type': 'application/json'}
+    return _GH_POOL.request(method, url, **kwargs)
 
 # Configure CORS for production - update this to your Vercel domain
 vercel_domain = os.getenv("VERCEL_URL", "")
-allowed_origins = [
+allowed_origins = tuple(o for o in (
     "http://localhost:3000",
     "http://localhost:8000",
     "https://" + vercel_domain if vercel_domain else None
-]
-allowed_origins = [o for o in allowed_origins if o]
+) if o)
 
+# Explicit origins are checked first; the regex covers Vercel preview deployments.
+# No "*" fallback - browsers reject a wildcard origin on credentialed requests.
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=allowed_origins if allowed_origins else ["*"],
+    allow_origins=list(allowed_origins),
+    allow_origin_regex=r"^https://[^/]*\.vercel\.app$|^http://localhost:(3000|8000)$",
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -47,37 +94,38 @@ def get_github_token(request_token: str = "") -> str:
     Returns empty string if no token provided - will push directly to original repo
     """
     if request_token:
-        print("Using GitHub token from request")
+        logger.info("Using GitHub token from request")
         return request_token
     # Try to get from environment
     env_token = os.getenv("GITHUB_TOKEN", "")
     if env_token:
-        print("Using GitHub token from environment variable GITHUB_TOKEN")
+        logger.info("Using GitHub token from environment variable GITHUB_TOKEN")
         return env_token
     # No token provided - will commit directly to original repository if permissions allow
-    print("No GitHub token provided - will attempt to commit directly to original repository")
+    logger.info("No GitHub token provided - will attempt to commit directly to original repository")
     return ""
 
 def run_command(cmd, cwd=None, ignore_error=False):
     """Cross-platform command execution
     
     Args:
-        cmd: Command to execute
+        cmd: Command to execute as an argv list (no shell is involved)
         cwd: Working directory
         ignore_error: If True, don't raise exception on non-zero exit code
     """
+    assert isinstance(cmd, list), "run_command expects an argv list"
     try:
         result = subprocess.run(
             cmd,
-            shell=True,
+            shell=False,
             cwd=cwd,
             capture_output=True,
             text=True,
             timeout=300
         )
         if result.returncode != 0 and not ignore_error:
-            print(f"Command failed: {cmd}")
-            print(f"Error: {result.stderr}")
+            logger.warning("Command failed: %s", cmd)
+            logger.warning("Error: %s", result.stderr)
         return result
     except FileNotFoundError as e:
         if not ignore_error:
@@ -88,46 +136,308 @@ def run_command(cmd, cwd=None, ignore_error=False):
             raise HTTPException(status_code=500, detail=f"Command failed: {str(e)}")
         return subprocess.CompletedProcess(cmd, 1, '', str(e))
 
+async def run_command_async(cmd, cwd=None, timeout=300):
+    """Async variant of run_command for network-bound git operations
+    
+    The child process is killed if the awaiting task is cancelled or times out,
+    so racing callers can abandon work they no longer need.
+    """
+    assert isinstance(cmd, list), "run_command_async expects an argv list"
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=cwd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except Exception as e:
+        return subprocess.CompletedProcess(cmd, 1, '', str(e))
+    
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    
+    return subprocess.CompletedProcess(
+        cmd, proc.returncode,
+        stdout.decode(errors='replace'), stderr.decode(errors='replace')
+    )
+
+# Use /tmp for Vercel (ephemeral filesystem)
+_TEMP_DIR = "/tmp/temp_repos"
+
+def discard_directory(path):
+    """Rename a directory out of the way and delete it on a background thread
+    
+    The rename is a single inode operation, so callers don't wait for the
+    per-file unlinks of a large checkout.
+    """
+    trash = f"{path}.trash.{os.getpid()}"
+    os.rename(path, trash)
+    threading.Thread(
+        target=shutil.rmtree, args=(trash,), kwargs={'ignore_errors': True}, daemon=True
+    ).start()
+
+def _sweep_trash():
+    """Remove trash directories left behind by a previous instance"""
+    try:
+        for entry in os.scandir(_TEMP_DIR):
+            if '.trash.' in entry.name:
+                shutil.rmtree(entry.path, ignore_errors=True)
+    except FileNotFoundError:
+        pass
+
+_sweep_trash()
+
+_SANITIZE_RE = re.compile(r'[<>:"/\\|?*]')
+
 def sanitize_filename(filename):
     """Remove invalid characters from filename"""
-    return re.sub(r'[<>:"/\\|?*]', '_', filename)
+    return _SANITIZE_RE.sub('_', filename)
 
-def clone_with_token(repo_url: str, clone_dir: str, token: str) -> tuple:
-    """Clone repository using GitHub token for authentication"""
+@functools.lru_cache(maxsize=128)
+def _parse_repo(repo_url):
+    """Extract owner, repo name and canonical URL from a GitHub URL
     
-    # Extract owner and repo
-    parts = repo_url.rstrip('/').replace('.git', '').split('/')
-    owner = parts[-2] if len(parts) >= 2 else ""
-    repo_name = parts[-1] if len(parts) >= 1 else ""
+    The canonical URL has no trailing slash or .git suffix. Owner and repo
+    name are None when the URL doesn't contain both.
+    """
+    canonical_url = repo_url.rstrip('/')
+    if canonical_url.endswith('.git'):
+        canonical_url = canonical_url[:-4]
+    parts = canonical_url.split('/')
+    if len(parts) >= 2 and parts[-2] and parts[-1]:
+        return parts[-2], parts[-1], canonical_url
+    return None, None, canonical_url
+
+async def _resolve_default_branch(clone_url: str) -> Optional[str]:
+    """Resolve the remote HEAD branch with a single ls-remote round-trip"""
+    result = await run_command_async(['git', 'ls-remote', '--symref', clone_url, 'HEAD'], timeout=30)
+    if result.returncode != 0:
+        return None
+    for line in result.stdout.splitlines():
+        # Format: "ref: refs/heads/<branch>\tHEAD"
+        if line.startswith('ref: refs/heads/'):
+            return line.split('\t', 1)[0][len('ref: refs/heads/'):]
+    return None
+
+# Bare mirrors survive across warm invocations: /tmp/gitfarm/<owner>/<repo>.git
+_MIRROR_ROOT = "/tmp/gitfarm"
+# Mirrors are evicted least recently used first beyond this total size, and
+# once unused for _MIRROR_MAX_AGE; /tmp is only 512MB on Vercel
+_MIRROR_MAX_BYTES = 200 * 1024 * 1024
+_MIRROR_MAX_AGE = 6 * 3600
+# Never evict a mirror used this recently - a request may still read objects
+# through its worktree after the fetch lock is released
+_MIRROR_MIN_AGE = 600
+
+def _git_auth_args(token: str) -> List[str]:
+    """Per-command git config that authenticates HTTPS requests
     
-    if not owner or not repo_name:
-        return False, "Invalid repository URL"
+    The token never lands in a remote URL, so it is not written to the shared
+    mirror's config; git hands -c settings down to the lazy blob fetches it
+    spawns for this command only.
+    """
+    if not token:
+        return []
+    credentials = base64.b64encode(f"x-access-token:{token}".encode()).decode('ascii')
+    return ['-c', f'http.extraHeader=Authorization: Basic {credentials}']
+
+def _directory_size(path: str) -> int:
+    """Total size of the files under path, in bytes"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def _evict_mirrors():
+    """Delete mirrors past _MIRROR_MAX_AGE, then oldest first down to _MIRROR_MAX_BYTES
+    
+    Last use is the mtime of the mirror's lock file. Mirrors whose lock is
+    held by another request are skipped.
+    """
+    mirrors = []
+    try:
+        for owner_entry in os.scandir(_MIRROR_ROOT):
+            if not owner_entry.is_dir():
+                continue
+            for entry in os.scandir(owner_entry.path):
+                if entry.name.endswith('.git') and entry.is_dir():
+                    try:
+                        last_used = os.path.getmtime(f"{entry.path}.lock")
+                    except OSError:
+                        last_used = entry.stat().st_mtime
+                    mirrors.append((last_used, _directory_size(entry.path), entry.path))
+    except FileNotFoundError:
+        return
+    
+    now = time.time()
+    total = 0
+    # Newest first, so the size budget goes to recently used mirrors
+    for last_used, size, path in sorted(mirrors, reverse=True):
+        total += size
+        age = now - last_used
+        if age < _MIRROR_MIN_AGE or (age < _MIRROR_MAX_AGE and total <= _MIRROR_MAX_BYTES):
+            continue
+        lock_fd = os.open(f"{path}.lock", os.O_CREAT | os.O_RDWR)
+        try:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+            logger.info("Evicting mirror %s (%d bytes, unused for %ds)", path, size, age)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        finally:
+            os.close(lock_fd)
+
+async def _sparse_checkout(repo_dir: str, auth_args: Optional[List[str]] = None) -> bool:
+    """Populate a --no-checkout working tree, leaving out the directories CodeAgent skips"""
+    result = await run_command_async(
+        ['git', '-C', repo_dir, 'sparse-checkout', 'set', '--no-cone', *CodeAgent.sparse_paths()]
+    )
+    if result.returncode != 0:
+        return False
+    # Blobs for the selected paths are fetched lazily from the promisor remote
+    result = await run_command_async(['git', *(auth_args or []), '-C', repo_dir, 'read-tree', '-mu', 'HEAD'])
+    return result.returncode == 0
+
+async def _checkout_from_mirror(mirror_url: str, token: str, owner: str, repo_name: str, branch: str, clone_dir: str) -> bool:
+    """Refresh the bare mirror for a repo and add a detached worktree at clone_dir
+    
+    The first request for a repo pays a full (blobless) clone; later ones only
+    fetch the branch tip. A file lock serializes fetches on the same mirror.
+    mirror_url must not contain credentials - it is stored in the mirror's
+    config and shared by every request; the token is passed per command.
+    """
+    bare = os.path.join(_MIRROR_ROOT, owner, f"{repo_name}.git")
+    os.makedirs(os.path.dirname(bare), exist_ok=True)
+    auth_args = _git_auth_args(token)
     
-    # Try different branch names
-    branches = ['main', 'master', 'develop']
+    if not os.path.isdir(bare):
+        # The cache is about to grow - make room first
+        await asyncio.to_thread(_evict_mirrors)
     
-    for branch in branches:
-        # Clone with token authentication
-        if token:
-            # Use HTTPS with token
-            auth_url = f"https://{token}@github.com/{owner}/{repo_name}.git"
-            cmd = f'git clone --branch {branch} --depth 1 "{auth_url}" "{clone_dir}"'
+    lock_fd = os.open(f"{bare}.lock", os.O_CREAT | os.O_RDWR)
+    try:
+        if fcntl:
+            await asyncio.to_thread(fcntl.flock, lock_fd, fcntl.LOCK_EX)
+        # Mark the mirror as recently used for eviction
+        os.utime(f"{bare}.lock")
+        
+        if os.path.isdir(bare):
+            # Mirrors created with a token in their URL are reset to the plain one
+            await run_command_async(['git', '-C', bare, 'remote', 'set-url', 'origin', mirror_url])
+            result = await run_command_async([
+                'git', *auth_args, '-C', bare, 'fetch', '--depth', '1', '--filter=blob:none', '--no-tags',
+                'origin', f'+refs/heads/{branch}:refs/heads/{branch}'
+            ])
+            # Drop worktree entries whose directories were already cleaned up
+            await run_command_async(['git', '-C', bare, 'worktree', 'prune'])
         else:
-            # Try without auth (public repo)
-            cmd = f'git clone --branch {branch} --depth 1 "{repo_url}" "{clone_dir}"'
+            result = await run_command_async([
+                'git', *auth_args, 'clone', '--bare', '--depth', '1', '--filter=blob:none', '--no-tags',
+                '--branch', branch, mirror_url, bare
+            ])
+            if result.returncode != 0:
+                shutil.rmtree(bare, ignore_errors=True)
         
-        result = run_command(cmd)
+        if result.returncode != 0:
+            return False
         
-        if result.returncode == 0 and os.path.exists(clone_dir):
-            try:
-                files = os.listdir(clone_dir)
-                if len(files) > 0:
-                    return True, f"Cloned via git (branch: {branch})"
-            except:
-                pass
+        result = await run_command_async(
+            ['git', '-C', bare, 'worktree', 'add', '--no-checkout', '--detach', clone_dir, branch]
+        )
+        if result.returncode == 0 and await _sparse_checkout(clone_dir, auth_args):
+            return True
+        
+        # Unregister and delete a half-made worktree, so the fallback clones
+        # can be moved into clone_dir
+        await run_command_async(['git', '-C', bare, 'worktree', 'remove', '--force', clone_dir])
+        shutil.rmtree(clone_dir, ignore_errors=True)
+        return False
+    finally:
+        # Closing the descriptor releases the flock
+        os.close(lock_fd)
+
+async def clone_with_token(repo_url: str, clone_dir: str, token: str, default_branch: Optional[str] = None) -> tuple:
+    """Clone repository using GitHub token for authentication
+    
+    The default branch (from repo metadata, or resolved with ls-remote) is
+    checked out as a worktree of a cached bare mirror, so repeat runs only
+    fetch the new tip. If that fails, the candidate branches are cloned
+    concurrently into sibling directories; the first successful clone is
+    moved into clone_dir and the rest are cancelled.
+    """
+    owner, repo_name, _ = _parse_repo(repo_url)
+    
+    if not owner or not repo_name:
+        return False, "Invalid repository URL"
+    
+    if token:
+        # Use HTTPS with token
+        clone_url = f"https://{token}@github.com/{owner}/{repo_name}.git"
+    else:
+        # Try without auth (public repo)
+        clone_url = repo_url
+    
+    if not default_branch:
+        default_branch = await _resolve_default_branch(clone_url)
+    if default_branch:
+        # The mirror is shared across requests, so it gets the URL without the token
+        mirror_url = f"https://github.com/{owner}/{repo_name}.git" if token else clone_url
+        if await _checkout_from_mirror(mirror_url, token, owner, repo_name, default_branch, clone_dir):
+            return True, f"Checked out from mirror cache (branch: {default_branch})"
+        branches = [default_branch]
+    else:
+        # Try different branch names
+        branches = ['main', 'master', 'develop']
+    
+    async def try_branch(branch):
+        target = f"{clone_dir}_{branch}"
+        result = await run_command_async([
+            'git', 'clone', '--branch', branch, '--depth', '1', '--filter=blob:none',
+            '--single-branch', '--no-tags', '--no-checkout', clone_url, target
+        ])
+        if result.returncode == 0 and await _sparse_checkout(target):
+            return branch
+        return None
+    
+    tasks = {asyncio.create_task(try_branch(branch)): branch for branch in branches}
+    winner = None
+    try:
+        pending = set(tasks)
+        while pending and not winner:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None and task.result():
+                    winner = task.result()
+                    break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for branch in branches:
+            if branch != winner:
+                shutil.rmtree(f"{clone_dir}_{branch}", ignore_errors=True)
+    
+    if winner:
+        os.rename(f"{clone_dir}_{winner}", clone_dir)
+        return True, f"Cloned via git (branch: {winner})"
     
     return False, "Git clone failed"
 
+# Archives larger than this spill from memory to a temp file while downloading
+_ZIP_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
 def download_and_extract_zip(repo_url, extract_to, token=""):
     """Download repo as ZIP and extract it"""
     
@@ -143,82 +453,118 @@ def download_and_extract_zip(repo_url, extract_to, token=""):
     
     os.makedirs(extract_to, exist_ok=True)
     
+    # HEAD both candidates in parallel and only GET the branch that exists;
+    # keep trying both if neither probe succeeds (e.g. HEAD blocked)
+    def probe(url):
+        try:
+            response = _GH_POOL.head(url, headers={'Accept': '*/*'}, follow_redirects=False)
+            return url if response.status_code in (200, 302) else None
+        except httpx.HTTPError:
+            return None
+    
+    with ThreadPoolExecutor(max_workers=len(branch_zip_urls)) as executor:
+        futures = [executor.submit(probe, url) for url in branch_zip_urls]
+        for future in as_completed(futures):
+            if future.result():
+                branch_zip_urls = [future.result()]
+                break
+    
     for zip_url in branch_zip_urls:
-        print(f"Trying to download: {zip_url}")
+        logger.debug("Trying to download: %s", zip_url)
         try:
-            temp_zip = os.path.join(extract_to, f"repo_{int(time.time())}.zip")
-            
-            # Create SSL context
-            try:
-                ssl_context = ssl.create_default_context()
-                ssl_context.check_hostname = False
-                ssl_context.verify_mode = ssl.CERT_NONE
-                urllib.request.urlretrieve(zip_url, temp_zip)
-            except:
-                # Fallback without SSL context
-                urllib.request.urlretrieve(zip_url, temp_zip)
-            
-            if os.path.exists(temp_zip) and zipfile.is_zipfile(temp_zip):
-                with zipfile.ZipFile(temp_zip, 'r') as zip_ref:
-                    zip_ref.extractall(extract_to)
-                    
-                    dirs = [d for d in os.listdir(extract_to) if os.path.isdir(os.path.join(extract_to, d)) and not d.startswith('.')]
-                    
-                    if dirs:
-                        extracted_repo_dir = os.path.join(extract_to, dirs[0])
-                        for item in os.listdir(extracted_repo_dir):
-                            src = os.path.join(extracted_repo_dir, item)
-                            dst = os.path.join(extract_to, item)
-                            if os.path.exists(dst):
-                                shutil.rmtree(dst, ignore_errors=True)
-                            shutil.move(src, dst)
-                        
-                        shutil.rmtree(extracted_repo_dir, ignore_errors=True)
+            # Archives stay in memory unless they outgrow _ZIP_SPOOL_MAX_SIZE,
+            # so the usual case never writes and re-reads a temp file
+            with tempfile.SpooledTemporaryFile(max_size=_ZIP_SPOOL_MAX_SIZE) as buf:
+                with _GH_POOL.stream(
+                    'GET',
+                    zip_url,
+                    headers={'Accept': '*/*'},
+                    follow_redirects=True,
+                    timeout=httpx.Timeout(60, connect=5)
+                ) as response:
+                    if response.status_code != 200:
+                        logger.debug("Download returned HTTP %s", response.status_code)
+                        continue
+                    for chunk in response.iter_bytes(65536):
+                        buf.write(chunk)
                 
-                try:
-                    if os.path.exists(temp_zip):
-                        os.remove(temp_zip)
-                except:
-                    pass
+                buf.seek(0)
+                if not zipfile.is_zipfile(buf):
+                    continue
                 
-                return True, "Downloaded via ZIP"
+                buf.seek(0)
+                with zipfile.ZipFile(buf, 'r') as zip_ref:
+                    # Strip the "<repo>-<branch>/" wrapper from each member so files
+                    # land directly in extract_to without a move pass afterwards
+                    for member in zip_ref.infolist():
+                        member.filename = member.filename.partition('/')[2]
+                        if member.filename:
+                            zip_ref.extract(member, extract_to)
             
-            if os.path.exists(temp_zip):
-                try:
-                    os.remove(temp_zip)
-                except:
-                    pass
+            return True, "Downloaded via ZIP"
             
         except Exception as e:
-            print(f"Failed to download from {zip_url}: {e}")
+            logger.warning("Failed to download from %s: %s", zip_url, e)
             continue
     
     return False, "Could not download repo as ZIP"
 
-def get_repo_info_from_url(repo_url):
-    """Extract owner and repo name from GitHub URL"""
-    parts = repo_url.rstrip('/').replace('.git', '').split('/')
-    if len(parts) >= 2:
-        return parts[-2], parts[-1]
-    return None, None
+# Repositories above this size (in KB, as reported by the GitHub API) are refused
+_MAX_REPO_SIZE_KB = int(os.getenv("MAX_REPO_SIZE_KB", "512000"))
+
+def get_repo_metadata(owner, repo_name, token=""):
+    """Fetch repository metadata (size, default branch) from the GitHub API
+    
+    Returns None if the repository doesn't exist or isn't visible to the token,
+    and an empty dict if the lookup itself failed.
+    """
+    headers = {'Authorization': f'token {token}'} if token else {}
+    try:
+        response = _GH_POOL.get(f"https://api.github.com/repos/{owner}/{repo_name}", headers=headers)
+    except httpx.HTTPError as e:
+        logger.warning("Repository metadata lookup failed: %s", e)
+        return {}
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        logger.warning("Repository metadata lookup returned HTTP %s", response.status_code)
+        return {}
+    return orjson.loads(response.content)
+
+# Resolved GitHub logins keyed by token: {token: (resolved_at, username)}
+_USER_CACHE: Dict[str, Tuple[float, str]] = {}
+_USER_CACHE_TTL = 300
 
 def get_authenticated_user(token):
-    """Get the authenticated GitHub user from token"""
+    """Get the authenticated GitHub user from token
+    
+    Results are cached per token for _USER_CACHE_TTL seconds so repeated
+    lookups within one /analyze call don't re-hit GET /user.
+    """
+    # Expired logins are dropped on every lookup, so tokens that are never
+    # used again don't stay in memory
+    now = time.time()
+    for key, (resolved_at, _) in list(_USER_CACHE.items()):
+        if now - resolved_at >= _USER_CACHE_TTL:
+            _USER_CACHE.pop(key, None)
+    cached = _USER_CACHE.get(token)
+    if cached:
+        return cached[1]
+    
     try:
-        import urllib.request
-        import json
-        req = urllib.request.Request(
-            'https://api.github.com/user',
-            headers={'Authorization': f'token {token}', 'Accept': 'application/vnd.github.v3+json'}
-        )
-        with urllib.request.urlopen(req, timeout=5) as response:
-            data = json.loads(response.read().decode())
-            username = data.get('login')
-            if username:
-                print(f"Successfully authenticated as: {username}")
-                return username
+        response = _GH_POOL.get('https://api.github.com/user', headers={'Authorization': f'token {token}'})
+        if response.status_code == 401:
+            _USER_CACHE.pop(token, None)
+            logger.warning("REST API method failed: token rejected (401)")
+            return None
+        response.raise_for_status()
+        username = orjson.loads(response.content).get('login')
+        if username:
+            logger.info("Successfully authenticated as: %s", username)
+            _USER_CACHE[token] = (time.time(), username)
+            return username
     except Exception as e:
-        print(f"REST API method failed: {e}")
+        logger.warning("REST API method failed: %s", e)
         pass
     
     # Try PyGithub if available
@@ -228,10 +574,11 @@ def get_authenticated_user(token):
         user = g.get_user()
         username = user.login
         if username:
-            print(f"Successfully authenticated as: {username}")
+            logger.info("Successfully authenticated as: %s", username)
+            _USER_CACHE[token] = (time.time(), username)
             return username
     except Exception as e:
-        print(f"PyGithub method failed: {e}")
+        logger.warning("PyGithub method failed: %s", e)
         pass
     
     return None
@@ -242,157 +589,241 @@ def fork_repository(original_owner, repo_name, token):
     Returns:
         tuple: (success: bool, message: str, fork_owner: str or None)
     """
+    auth_headers = {'Authorization': f'token {token}'}
     try:
-        import urllib.request
-        import json
-        
         # Get authenticated user first
         target_user = get_authenticated_user(token)
         if not target_user:
             return False, "Could not authenticate user", None
         
-        print(f"Target user: {target_user}")
+        logger.debug("Target user: %s", target_user)
         
         # Check if fork already exists
         check_url = f"https://api.github.com/repos/{target_user}/{repo_name}"
         try:
-            req = urllib.request.Request(
-                check_url,
-                headers={'Authorization': f'token {token}', 'Accept': 'application/vnd.github.v3+json'}
-            )
-            with urllib.request.urlopen(req, timeout=5) as response:
-                print(f"Fork already exists at {target_user}/{repo_name}")
+            response = _GH_POOL.get(check_url, headers=auth_headers)
+            if response.status_code == 200:
+                logger.info("Fork already exists at %s/%s", target_user, repo_name)
                 return True, "Fork already exists", target_user
-        except urllib.error.HTTPError as e:
-            if e.code != 404:
-                return False, f"Error checking fork: {e}", None
-        except Exception as e:
-            print(f"Check fork error: {e}")
+            if response.status_code != 404:
+                return False, f"Error checking fork: HTTP {response.status_code}", None
+        except httpx.HTTPError as e:
+            logger.warning("Check fork error: %s", e)
         
         # Create the fork
         fork_url = f"https://api.github.com/repos/{original_owner}/{repo_name}/forks"
-        data = json.dumps({"owner": target_user}).encode('utf-8')
         
-        req = urllib.request.Request(
-            fork_url,
-            data=data,
-            headers={
-                'Authorization': f'token {token}',
-                'Accept': 'application/vnd.github.v3+json',
-                'Content-Type': 'application/json'
-            },
-            method='POST'
-        )
+        logger.info("Creating fork from %s/%s to %s/%s...", original_owner, repo_name, target_user, repo_name)
+        response = _gh_request('POST', fork_url, {"owner": target_user}, headers=auth_headers, timeout=30)
         
-        print(f"Creating fork from {original_owner}/{repo_name} to {target_user}/{repo_name}...")
-        with urllib.request.urlopen(req, timeout=30) as response:
-            fork_data = json.loads(response.read().decode())
-            print(f"Fork created successfully!")
-            time.sleep(2)
-            return True, f"Forked to {target_user}/{repo_name}", target_owner
-            
-    except urllib.error.HTTPError as e:
-        error_body = e.read().decode() if hasattr(e, 'read') else str(e)
-        print(f"HTTP Error {e.code}: {error_body}")
-        if e.code == 422:
-            target_user = get_authenticated_user(token)
+        if response.status_code == 422:
+            logger.warning("HTTP Error 422: %s", response.text)
             return True, "Repository already forked", target_user
-        return False, f"Failed to fork: {error_body}", None
+        if response.status_code >= 400:
+            logger.warning("HTTP Error %s: %s", response.status_code, response.text)
+            return False, f"Failed to fork: {response.text}", None
+        
+        logger.info("Fork created successfully!")
+        time.sleep(2)
+        return True, f"Forked to {target_user}/{repo_name}", target_user
+            
     except Exception as e:
-        print(f"Fork error: {e}")
+        logger.warning("Fork error: %s", e)
         return False, f"Failed to fork: {str(e)}", None
 
+_GIT_IDENTITY = ['-c', 'user.email=ai-agent@rift.dev', '-c', 'user.name=AI Agent']
+
+# Above this many changed files a regular git push is cheaper than per-blob API calls
+_API_PUSH_MAX_FILES = 50
+
+def push_via_git_data_api(repo_dir, owner, repo_name, branch_name, token):
+    """Publish the local HEAD commit through the GitHub Git Data API
+    
+    Creates the changed blobs, a tree on top of the parent commit's tree, a
+    commit and the branch ref - all over the pooled keep-alive connection.
+    
+    Returns:
+        tuple: (success: bool, message: str)
+    """
+    api_base = f"https://api.github.com/repos/{owner}/{repo_name}/git"
+    auth_headers = {'Authorization': f'token {token}'}
+    
+    # Parent commit and its tree; fails for fresh ZIP-based repos with no history
+    result = run_command(['git', 'rev-parse', 'HEAD~1', 'HEAD~1^{tree}'], cwd=repo_dir, ignore_error=True)
+    if result.returncode != 0:
+        return False, "No parent commit to build on"
+    base_sha, base_tree = result.stdout.split()
+    
+    # Raw diff lines look like ":100644 100644 <old> <new> M\t<path>"
+    result = run_command(['git', 'diff', '--raw', '--no-renames', 'HEAD~1', 'HEAD'], cwd=repo_dir, ignore_error=True)
+    if result.returncode != 0:
+        return False, "Could not list changed files"
+    changes = []
+    for line in result.stdout.splitlines():
+        meta, path = line.split('\t', 1)
+        new_mode, status = meta.split()[1], meta.split()[4]
+        changes.append((path, new_mode, status))
+    
+    if not changes or len(changes) > _API_PUSH_MAX_FILES:
+        return False, f"{len(changes)} changed files - using git push"
+    
+    def create_blob(change):
+        path, mode, status = change
+        if status == 'D':
+            # A null sha removes the path from the base tree
+            return {'path': path, 'mode': '100644', 'type': 'blob', 'sha': None}
+        with open(os.path.join(repo_dir, path), 'rb') as f:
+            content = base64.b64encode(f.read()).decode('ascii')
+        response = _gh_request(
+            'POST', f"{api_base}/blobs",
+            {'content': content, 'encoding': 'base64'},
+            headers=auth_headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        return {'path': path, 'mode': mode, 'type': 'blob', 'sha': orjson.loads(response.content)['sha']}
+    
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            tree_entries = list(executor.map(create_blob, changes))
+        
+        response = _gh_request(
+            'POST', f"{api_base}/trees",
+            {'base_tree': base_tree, 'tree': tree_entries},
+            headers=auth_headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        tree_sha = orjson.loads(response.content)['sha']
+        
+        response = _gh_request(
+            'POST', f"{api_base}/commits",
+            {
+                'message': "[AI-AGENT] Auto-fixes applied by DevOps Agent",
+                'tree': tree_sha,
+                'parents': [base_sha],
+                'author': {'name': "AI Agent", 'email': "ai-agent@rift.dev"}
+            },
+            headers=auth_headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        commit_sha = orjson.loads(response.content)['sha']
+        
+        response = _gh_request(
+            'POST', f"{api_base}/refs",
+            {'ref': f"refs/heads/{branch_name}", 'sha': commit_sha},
+            headers=auth_headers
+        )
+        if response.status_code == 422:
+            # Branch already exists from a previous run - move it to the new commit
+            response = _gh_request(
+                'PATCH', f"{api_base}/refs/heads/{branch_name}",
+                {'sha': commit_sha, 'force': True},
+                headers=auth_headers
+            )
+        response.raise_for_status()
+    except Exception as e:
+        logger.warning("Git Data API push failed: %s", e)
+        return False, f"Git Data API push failed: {e}"
+    
+    return True, f"Pushed {len(changes)} files via GitHub API"
+
 def commit_and_push(repo_dir, branch_name, token, repo_url, is_user_token=False):
     """Commit fixes and push to GitHub
     
-    Note: This may timeout on Vercel serverless - consider using GitHub API instead
+    Small fix sets are published through the Git Data API when a token is
+    available, since a git push may time out on Vercel serverless.
     """
-    original_owner, repo_name = get_repo_info_from_url(repo_url)
+    original_owner, repo_name, canonical_url = _parse_repo(repo_url)
     
     if not original_owner or not repo_name:
-        return None, "Could not parse repository info from URL"
+        return None, "Could not parse repository info from URL", None
+    
+    # The token's login is returned to the caller as well, so the branch URL
+    # fallback in analyze_repo doesn't have to resolve it again
+    user = get_authenticated_user(token) if is_user_token else None
     
     # Determine target owner based on token type
     if is_user_token:
-        target_owner = get_authenticated_user(token)
+        target_owner = user
         if not target_owner:
-            return None, "Could not authenticate with provided token. Please verify it's valid."
+            return None, "Could not authenticate with provided token. Please verify it's valid.", user
         
-        print(f"\nAttempting to fork repository {original_owner}/{repo_name} to user account {target_owner}...")
+        logger.info("Attempting to fork repository %s/%s to user account %s...", original_owner, repo_name, target_owner)
         fork_success, fork_msg, fork_owner = fork_repository(original_owner, repo_name, token)
         
         if not fork_success:
-            return None, f"Failed to fork repository: {fork_msg}"
+            return None, f"Failed to fork repository: {fork_msg}", user
         
         if fork_owner:
             target_owner = fork_owner
         
-        print(f"Using user's GitHub account (forked): {target_owner}")
+        logger.info("Using user's GitHub account (forked): %s", target_owner)
     else:
         target_owner = original_owner
-        print(f"No token provided - pushing directly to original repository: {target_owner}")
-    
-    # Configure git
-    run_command('git config user.email "ai-agent@rift.dev"', cwd=repo_dir)
-    run_command('git config user.name "AI Agent"', cwd=repo_dir)
-    run_command('git config init.defaultBranch main', cwd=repo_dir)
+        logger.info("No token provided - pushing directly to original repository: %s", target_owner)
     
     if is_user_token:
-        print("Waiting for GitHub to process the fork...")
+        logger.info("Waiting for GitHub to process the fork...")
         time.sleep(3)
     
-    # Reset git remote and reinitialize if needed
-    if os.path.exists(os.path.join(repo_dir, '.git')):
-        run_command('git remote remove origin', cwd=repo_dir, ignore_error=True)
-    else:
-        run_command('git init', cwd=repo_dir)
+    # Reinitialize if the sources came from a ZIP download
+    if not os.path.exists(os.path.join(repo_dir, '.git')):
+        run_command(['git', '-c', 'init.defaultBranch=main', 'init'], cwd=repo_dir)
     
-    # Add the target remote
+    # Push by URL rather than rewriting remotes - mirror worktrees share their
+    # config and branches with the cached bare repository
     if token:
         push_url = f"https://{token}@github.com/{target_owner}/{repo_name}.git"
     else:
         push_url = f"https://github.com/{target_owner}/{repo_name}.git"
     
-    run_command(f'git remote add origin "{push_url}"', cwd=repo_dir)
-    
-    # Checkout new branch
-    run_command(f'git checkout -b {branch_name}', cwd=repo_dir, ignore_error=True)
-    run_command(f'git checkout {branch_name}', cwd=repo_dir, ignore_error=True)
-    
     # Add all changes
-    run_command('git add -A', cwd=repo_dir)
+    run_command(['git', 'add', '-A'], cwd=repo_dir)
     
     # Check if there are changes to commit
-    result = run_command('git status --porcelain', cwd=repo_dir)
+    result = run_command(['git', 'status', '--porcelain'], cwd=repo_dir)
     if not result.stdout.strip():
-        return None, "No changes to commit"
+        return None, "No changes to commit", user
     
-    # Commit
-    run_command('git commit -m "[AI-AGENT] Auto-fixes applied by DevOps Agent"', cwd=repo_dir)
+    # Commit - identity is passed inline instead of persisted with separate git config calls
+    run_command(
+        ['git', *_GIT_IDENTITY, 'commit', '-m', "[AI-AGENT] Auto-fixes applied by DevOps Agent"],
+        cwd=repo_dir
+    )
+    
+    if is_user_token:
+        branch_link = f"https://github.com/{target_owner}/{repo_name}/tree/{branch_name}"
+    else:
+        branch_link = canonical_url
+    
+    # Small fix sets go through the REST API; fall back to git push otherwise
+    if token:
+        api_success, api_msg = push_via_git_data_api(repo_dir, target_owner, repo_name, branch_name, token)
+        if api_success:
+            return branch_link, "Successfully pushed", user
+        logger.warning("%s - falling back to git push", api_msg)
     
     # Try to push
-    print(f"Attempting to push to: {push_url}")
-    push_result = run_command(f'git push -u origin {branch_name}', cwd=repo_dir)
+    logger.info("Attempting to push to: %s/%s", target_owner, repo_name)
+    push_result = run_command(['git', 'push', push_url, f'HEAD:refs/heads/{branch_name}'], cwd=repo_dir)
     
     if push_result.returncode == 0:
-        if is_user_token:
-            branch_link = f"https://github.com/{target_owner}/{repo_name}/tree/{branch_name}"
-        else:
-            branch_link = repo_url.rstrip('.git')
-        return branch_link, "Successfully pushed"
+        return branch_link, "Successfully pushed", user
     else:
         error_msg = push_result.stderr if push_result.stderr else push_result.stdout
-        print(f"Push failed with error: {error_msg}")
+        logger.warning("Push failed with error: %s", error_msg)
         
         if not token:
-            return None, f"Push to {target_owner}/{repo_name} failed. You may need to provide GitHub credentials or a valid GitHub token. Error: {error_msg}"
+            return None, f"Push to {target_owner}/{repo_name} failed. You may need to provide GitHub credentials or a valid GitHub token. Error: {error_msg}", user
         
         if "404" in error_msg or "not found" in error_msg:
-            return None, f"Repository not found in {target_owner}'s account. Please fork the repository first: https://github.com/{original_owner}/{repo_name}/fork"
+            return None, f"Repository not found in {target_owner}'s account. Please fork the repository first: https://github.com/{original_owner}/{repo_name}/fork", user
         elif "Permission denied" in error_msg or "403" in error_msg:
-            return None, f"Permission denied. Make sure your token has push access to {target_owner}/{repo_name}"
+            return None, f"Permission denied. Make sure your token has push access to {target_owner}/{repo_name}", user
         else:
-            return None, f"Push failed: {error_msg}"
+            return None, f"Push failed: {error_msg}", user
 
 @app.get("/")
 def read_root():
@@ -457,37 +888,50 @@ async def analyze_repo(req: AnalyzeRequest):
         token_source = "Environment variable (GITHUB_TOKEN)"
     else:
         token_source = "No token - pushing directly to original repository"
-    print(f"Using: {token_source}")
+    logger.info("Using: %s", token_source)
     
     # Branch name format
     branch_name = f"{req.team_name.upper().replace(' ', '_')}_{req.leader_name.upper().replace(' ', '_')}_AI_Fix"
     
     # Repository setup
-    repo_name = req.repo_url.split("/")[-1].replace(".git", "")
-    repo_name = sanitize_filename(repo_name)
+    repo_owner, repo_name, canonical_url = _parse_repo(req.repo_url)
+    dir_name = sanitize_filename(repo_name or "")
+    
+    # Check existence and size with one API call before paying for a clone
+    repo_meta = {}
+    if repo_owner and canonical_url.startswith(("https://github.com/", "http://github.com/")):
+        repo_meta = await asyncio.to_thread(get_repo_metadata, repo_owner, repo_name, github_token)
+        if repo_meta is None:
+            raise HTTPException(status_code=404, detail="Repository not found or not accessible")
+        repo_size = repo_meta.get('size', 0)
+        if repo_size > _MAX_REPO_SIZE_KB:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Repository is too large ({repo_size} KB, limit {_MAX_REPO_SIZE_KB} KB)"
+            )
     
-    # Use /tmp for Vercel (ephemeral filesystem)
-    temp_dir = "/tmp/temp_repos"
-    os.makedirs(temp_dir, exist_ok=True)
+    os.makedirs(_TEMP_DIR, exist_ok=True)
     
     timestamp = int(time.time())
-    clone_dir = os.path.join(temp_dir, f"{repo_name}_{timestamp}")
+    clone_dir = os.path.join(_TEMP_DIR, f"{dir_name}_{timestamp}")
     
-    print(f"Downloading {req.repo_url} to {clone_dir}...")
+    logger.info("Downloading %s to %s...", req.repo_url, clone_dir)
     
     # Configure git
-    run_command("git config --global core.longpaths true")
+    await asyncio.to_thread(run_command, ['git', 'config', '--global', 'core.longpaths', 'true'])
     
     # Try cloning with token
     success = False
     message = ""
     
-    success, message = clone_with_token(req.repo_url, clone_dir, github_token)
+    success, message = await clone_with_token(
+        req.repo_url, clone_dir, github_token, default_branch=repo_meta.get('default_branch')
+    )
     
     # Fallback to ZIP download
     if not success:
-        print("Git clone failed, trying ZIP download...")
-        success, message = download_and_extract_zip(req.repo_url, clone_dir, github_token)
+        logger.warning("Git clone failed, trying ZIP download...")
+        success, message = await asyncio.to_thread(download_and_extract_zip, req.repo_url, clone_dir, github_token)
     
     if not success:
         raise HTTPException(status_code=400, detail=f"Failed to download repository: {message}")
@@ -504,53 +948,59 @@ async def analyze_repo(req: AnalyzeRequest):
     
     # Run the Agent
     try:
-        print(f"Executing agent with max_iterations: {max_iterations}")
+        logger.info("Executing agent with max_iterations: %s", max_iterations)
         agent = CodeAgent(clone_dir, github_token=github_token)
-        agent_result = agent.execute(max_iterations=max_iterations)
-        print(f"Agent execution completed with {agent_result.get('total_iterations', 0)} iterations")
+        agent_result = await asyncio.to_thread(agent.execute, max_iterations=max_iterations)
+        logger.info("Agent execution completed with %s iterations", agent_result.get('total_iterations', 0))
     except Exception as e:
-        print(f"Agent error: {str(e)}")
+        logger.error("Agent error: %s", e)
         raise HTTPException(status_code=500, detail=f"Agent execution failed: {str(e)}")
     
-    # Commit and Push to GitHub
+    # Commit and Push to GitHub - runs in the background while the
+    # agent-derived part of the response is prepared
+    logger.info("Attempting to push branch to GitHub repository...")
+    push_task = asyncio.create_task(asyncio.to_thread(
+        commit_and_push, clone_dir, branch_name, github_token, req.repo_url, is_user_token=is_user_token
+    ))
+    
+    cicd_status = "PASSED"
+    if agent_result.get('cicd_runs'):
+        cicd_status = agent_result['cicd_runs'][-1].get('status', 'PASSED')
+    fixes = agent_result.get('fixes', [])
+    push_destination = "User's GitHub Account (Forked)" if is_user_token else "Original Repository"
+    
     branch_url = None
     push_status = "Not pushed"
     
-    print(f"Attempting to push branch to GitHub repository...")
-    push_url, push_msg = commit_and_push(clone_dir, branch_name, github_token, req.repo_url, is_user_token=is_user_token)
+    push_url, push_msg, token_user = await push_task
     if push_url:
         branch_url = push_url
         push_status = "Pushed successfully"
         if is_user_token:
-            print(f"Branch pushed to user's GitHub: {push_url}")
+            logger.info("Branch pushed to user's GitHub: %s", push_url)
         else:
-            print(f"Branch pushed to repository: {push_url}")
+            logger.info("Branch pushed to repository: %s", push_url)
     else:
         push_status = f"Push skipped: {push_msg}"
-        print(f"Push skipped: {push_msg}")
+        logger.warning("Push skipped: %s", push_msg)
     
     # Generate branch URL if not pushed
     if not branch_url:
-        repo_owner, repo_name = get_repo_info_from_url(req.repo_url)
         if repo_owner and repo_name:
+            # Fork branch for user tokens, with the login commit_and_push resolved
             if is_user_token:
-                target_owner = get_authenticated_user(github_token)
-                if target_owner:
-                    branch_url = f"https://github.com/{target_owner}/{repo_name}/tree/{branch_name}"
+                if token_user:
+                    branch_url = f"https://github.com/{token_user}/{repo_name}/tree/{branch_name}"
                 else:
                     branch_url = f"https://github.com/{repo_owner}/{repo_name}/tree/{branch_name}"
             else:
-                branch_url = req.repo_url.rstrip('.git')
+                branch_url = canonical_url
         else:
-            branch_url = f"{req.repo_url.rstrip('.git')}/tree/{branch_name}"
+            branch_url = f"{canonical_url}/tree/{branch_name}"
     
     # Prepare Response
     duration = round(time.time() - start_time, 2)
     
-    cicd_status = "PASSED"
-    if agent_result.get('cicd_runs'):
-        cicd_status = agent_result['cicd_runs'][-1].get('status', 'PASSED')
-    
     result_data = {
         "repo_url": req.repo_url,
         "team_name": req.team_name,
@@ -559,23 +1009,23 @@ async def analyze_repo(req: AnalyzeRequest):
         "branch_url": branch_url,
         "push_status": push_status,
         "token_used": token_source,
-        "push_destination": "User's GitHub Account (Forked)" if is_user_token else "Original Repository",
+        "push_destination": push_destination,
         "max_iterations_used": max_iterations,
         "total_failures_detected": agent_result.get('unique_bugs', 0),
-        "total_fixes_applied": len(agent_result.get('fixes', [])),
+        "total_fixes_applied": len(fixes),
         "cicd_status": cicd_status,
         "total_time_taken": duration,
         "total_iterations": agent_result.get('total_iterations', 1),
-        "fixes": agent_result.get('fixes', []),
+        "fixes": fixes,
         "cicd_runs": agent_result.get('cicd_runs', [])
     }
     
     # Cleanup temp directory
     try:
         if os.path.exists(clone_dir):
-            shutil.rmtree(clone_dir, ignore_errors=True)
+            discard_directory(clone_dir)
     except Exception as e:
-        print(f"Cleanup warning: {e}")
+        logger.warning("Cleanup warning: %s", e)
     
     return result_data
 
@@ -1,22 +1,44 @@
+import asyncio
+import functools
 import os
 import re
 import subprocess
 import time
-import json
+import shlex
 import shutil
-import zipfile
-import urllib.request
 import ssl
-from fastapi import FastAPI, HTTPException
+import stat
+import io
+import tarfile
+import certifi
+import httpx
+import orjson
+from fastapi import BackgroundTasks, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 
 # Import the agent logic
 from agent_logic import CodeAgent
 
 app = FastAPI(title="DevOps Agent API")
 
+# One verifying SSL context per process - the CA bundle is loaded once at import.
+# DEVOPS_AGENT_INSECURE=1 turns verification off for local debugging proxies.
+if os.getenv("DEVOPS_AGENT_INSECURE") == "1":
+    _SSL_CTX = False
+else:
+    _SSL_CTX = ssl.create_default_context(cafile=certifi.where())
+
+# Shared connection pool for GitHub REST calls - the TLS handshake to
+# api.github.com is paid once instead of on every user lookup and fork call
+_GH_POOL = httpx.Client(
+    headers={'Accept': 'application/vnd.github.v3+json'},
+    limits=httpx.Limits(max_connections=16, max_keepalive_connections=4),
+    transport=httpx.HTTPTransport(verify=_SSL_CTX, retries=2),
+    timeout=5
+)
+
 # Enable CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -50,22 +72,26 @@ def get_github_token(request_token: str = "") -> str:
     print("No GitHub token provided - will attempt to commit directly to original repository")
     return ""
 
-def run_command(cmd, cwd=None, ignore_error=False):
+def run_command(cmd, cwd=None, ignore_error=False, env=None):
     """Cross-platform command execution
     
     Args:
-        cmd: Command to execute
+        cmd: Command to execute as an argv list; strings are split with shlex
         cwd: Working directory
         ignore_error: If True, don't raise exception on non-zero exit code
+        env: Extra environment variables for the command
     """
+    if isinstance(cmd, str):
+        cmd = shlex.split(cmd)
     try:
         result = subprocess.run(
             cmd,
-            shell=True,
+            shell=False,
             cwd=cwd,
             capture_output=True,
             text=True,
-            timeout=300
+            timeout=300,
+            env={**os.environ, **env} if env else None
         )
         if result.returncode != 0 and not ignore_error:
             print(f"Command failed: {cmd}")
@@ -80,185 +106,318 @@ def run_command(cmd, cwd=None, ignore_error=False):
             raise HTTPException(status_code=500, detail=f"Command failed: {str(e)}")
         return subprocess.CompletedProcess(cmd, 1, '', str(e))
 
+def _chmod_retry(func, path, exc_info):
+    """rmtree error hook: clear the read-only bit (git pack files) and retry"""
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+async def run_command_async(cmd, cwd=None, ignore_error=False, env=None, timeout=300):
+    """Non-blocking run_command for the git calls made from /analyze
+    
+    The child is killed if it outlives the timeout or the request is
+    cancelled, so a stuck clone never keeps running in the background.
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=cwd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, **env} if env else None
+        )
+    except Exception as e:
+        return subprocess.CompletedProcess(cmd, 1, '', str(e))
+    
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        return subprocess.CompletedProcess(cmd, 1, '', f"Timed out after {timeout}s")
+    
+    result = subprocess.CompletedProcess(
+        cmd, proc.returncode,
+        stdout.decode(errors='replace'), stderr.decode(errors='replace')
+    )
+    if result.returncode != 0 and not ignore_error:
+        print(f"Command failed: {cmd}")
+        print(f"Error: {result.stderr}")
+    return result
+
 def force_delete_directory(path):
-    """Force delete a directory on Windows"""
-    max_retries = 3
-    for attempt in range(max_retries):
+    """Force delete a directory, including read-only files on Windows"""
+    for attempt in range(2):
         try:
             if os.path.exists(path):
-                subprocess.run(f'rmdir /s /q "{path}"', shell=True, capture_output=True)
-                time.sleep(0.5)
-                if os.path.exists(path):
-                    shutil.rmtree(path, ignore_errors=True)
+                shutil.rmtree(path, onerror=_chmod_retry)
             return True
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(1)
-            else:
-                print(f"Warning: Could not delete {path}: {e}")
-                return False
+        except OSError as e:
+            # WinError 32: a file is still held open by another process
+            if attempt == 0 and getattr(e, 'winerror', None) == 32:
+                time.sleep(0.5)
+                continue
+            print(f"Warning: Could not delete {path}: {e}")
+            return False
     return False
 
+_INVALID_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*]')
+_WHITESPACE_RUN = re.compile(r'\s+')
+
 def sanitize_filename(filename):
     """Remove invalid Windows characters from filename"""
-    return re.sub(r'[<>:"/\\|?*]', '_', filename)
+    return _INVALID_FILENAME_CHARS.sub('_', filename)
+
+def branch_name_part(name):
+    """Upper-case a team/leader name with whitespace runs collapsed to '_'"""
+    return _WHITESPACE_RUN.sub('_', name).upper()
+
+# Git must fail rather than wait for credentials on the server's terminal
+_GIT_NO_PROMPT = {"GIT_TERMINAL_PROMPT": "0"}
+
+async def _resolve_default_branch(clone_url: str) -> Optional[str]:
+    """Resolve the remote HEAD branch with a single ls-remote round-trip"""
+    result = await run_command_async(['git', 'ls-remote', '--symref', clone_url, 'HEAD'], ignore_error=True, env=_GIT_NO_PROMPT)
+    if result.returncode != 0:
+        return None
+    for line in result.stdout.splitlines():
+        # Format: "ref: refs/heads/<branch>\tHEAD"
+        if line.startswith('ref: refs/heads/'):
+            return line.split('\t', 1)[0][len('ref: refs/heads/'):]
+    return None
 
-def clone_with_token(repo_url: str, clone_dir: str, token: str) -> tuple:
-    """Clone repository using GitHub token for authentication"""
+async def _probe_branches(clone_url: str, candidates: List[str]) -> List[str]:
+    """Return which candidate branches exist on the remote, in candidate order"""
+    result = await run_command_async(
+        ['git', 'ls-remote', '--heads', clone_url, *candidates],
+        ignore_error=True, env=_GIT_NO_PROMPT
+    )
+    if result.returncode != 0:
+        return []
+    # Format: "<sha>\trefs/heads/<branch>"
+    found = {line.split('\trefs/heads/', 1)[-1] for line in result.stdout.splitlines()}
+    return [branch for branch in candidates if branch in found]
+
+def _git_url(owner: str, repo_name: str, token: str, public_url: Optional[str] = None) -> str:
+    """HTTPS git URL for a GitHub repository
     
-    # Extract owner and repo
-    parts = repo_url.rstrip('/').replace('.git', '').split('/')
-    owner = parts[-2] if len(parts) >= 2 else ""
-    repo_name = parts[-1] if len(parts) >= 1 else ""
+    With a token it is embedded for authentication; without one, public_url
+    (the URL the user entered) or the plain github.com URL is used.
+    """
+    if token:
+        return f"https://{token}@github.com/{owner}/{repo_name}.git"
+    return public_url or f"https://github.com/{owner}/{repo_name}.git"
+
+async def clone_with_token(clone_url: str, clone_dir: str) -> tuple:
+    """Clone repository using GitHub token for authentication
     
-    if not owner or not repo_name:
+    clone_url is built once per request by the caller (see _git_url). The
+    default branch is resolved with ls-remote so a single partial clone is
+    enough; if the remote does not report it, the main/master/develop
+    guesses are probed together and only the first existing one is cloned.
+    """
+    
+    if not clone_url:
         return False, "Invalid repository URL"
     
-    # Try different branch names
-    branches = ['main', 'master', 'develop']
+    branch = await _resolve_default_branch(clone_url)
+    if not branch:
+        # Probe the usual branch names in one ls-remote instead of cloning each
+        branches = await _probe_branches(clone_url, ['main', 'master', 'develop'])
+        if not branches:
+            return False, "Git clone failed"
+        branch = branches[0]
+    
+    # HTTP/2 multiplexes ref negotiation and the pack download on one connection
+    cmd = [
+        'git', '-c', 'http.version=HTTP/2', 'clone', '--branch', branch, '--depth', '1',
+        '--filter=blob:none', '--single-branch', clone_url, clone_dir
+    ]
+    result = await run_command_async(cmd, env=_GIT_NO_PROMPT)
     
-    for branch in branches:
-        # Clone with token authentication
-        if token:
-            # Use HTTPS with token
-            auth_url = f"https://{token}@github.com/{owner}/{repo_name}.git"
-            cmd = f'git clone --branch {branch} --depth 1 "{auth_url}" "{clone_dir}"'
-        else:
-            # Try without auth (public repo)
-            cmd = f'git clone --branch {branch} --depth 1 "{repo_url}" "{clone_dir}"'
-        
-        result = run_command(cmd)
-        
-        if result.returncode == 0 and os.path.exists(clone_dir):
-            try:
-                files = os.listdir(clone_dir)
-                if len(files) > 0:
-                    return True, f"Cloned via git (branch: {branch})"
-            except:
-                pass
+    if result.returncode == 0 and os.path.exists(clone_dir):
+        try:
+            files = os.listdir(clone_dir)
+            if len(files) > 0:
+                return True, f"Cloned via git (branch: {branch})"
+        except:
+            pass
+    
+    # Clear any partial clone so the archive fallback starts from a clean path
+    if os.path.exists(clone_dir):
+        await asyncio.to_thread(force_delete_directory, clone_dir)
     
     return False, "Git clone failed"
 
-def download_and_extract_zip(repo_url, extract_to, token=""):
-    """Download repo as ZIP and extract it"""
+class _StreamReader(io.RawIOBase):
+    """Read-only file over an iterator of byte chunks, for tarfile's streaming mode"""
+    
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = memoryview(b'')
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        while not self._pending:
+            chunk = next(self._chunks, b'')
+            if not chunk:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+def download_and_extract_tarball(canonical_url, extract_to, token="", owner=None, repo_name=None):
+    """Download repo as a .tar.gz and extract it while it streams in
+    
+    The archive goes HTTP -> gunzip -> tar -> disk in one pass, without ever
+    being stored; the "<repo>-<branch>/" wrapper directory is stripped from
+    each member, like tar's --strip-components=1.
+    
+    The default branch is fetched through the API tarball endpoint on the
+    shared pool first, then the main/master archives as a fallback.
     
-    zip_url = repo_url.rstrip('/')
-    if zip_url.endswith('.git'):
-        zip_url = zip_url[:-4]
+    Returns:
+        tuple: (success: bool, message: str, base_ref: commit SHA or branch the
+        sources came from, so the push path can fetch exactly that commit)
+    """
     
+    # (url, extra headers, ref to fall back on if the archive carries no commit id)
+    candidates = []
+    if owner and repo_name:
+        api_headers = {'Authorization': f'token {token}'} if token else {}
+        candidates.append((f"https://api.github.com/repos/{owner}/{repo_name}/tarball", api_headers, 'HEAD'))
     # Try different branches
-    branch_zip_urls = [
-        f"{zip_url}/archive/refs/heads/main.zip",
-        f"{zip_url}/archive/refs/heads/master.zip",
+    candidates += [
+        (f"{canonical_url}/archive/refs/heads/main.tar.gz", {}, 'main'),
+        (f"{canonical_url}/archive/refs/heads/master.tar.gz", {}, 'master'),
     ]
     
     os.makedirs(extract_to, exist_ok=True)
+    root = os.path.realpath(extract_to)
     
-    for zip_url in branch_zip_urls:
-        print(f"Trying to download: {zip_url}")
+    for archive_url, headers, fallback_ref in candidates:
+        print(f"Trying to download: {archive_url}")
         try:
-            temp_zip = os.path.join(extract_to, f"repo_{int(time.time())}.zip")
-            
-            # Create SSL context that doesn't verify (for older Python versions)
-            try:
-                import ssl
-                ssl_context = ssl.create_default_context()
-                ssl_context.check_hostname = False
-                ssl_context.verify_mode = ssl.CERT_NONE
-                urllib.request.urlretrieve(zip_url, temp_zip)
-            except:
-                # Fallback without SSL context
-                urllib.request.urlretrieve(zip_url, temp_zip)
-            
-            if os.path.exists(temp_zip) and zipfile.is_zipfile(temp_zip):
-                with zipfile.ZipFile(temp_zip, 'r') as zip_ref:
-                    zip_ref.extractall(extract_to)
-                    
-                    dirs = [d for d in os.listdir(extract_to) if os.path.isdir(os.path.join(extract_to, d)) and not d.startswith('.')]
-                    
-                    if dirs:
-                        extracted_repo_dir = os.path.join(extract_to, dirs[0])
-                        for item in os.listdir(extracted_repo_dir):
-                            src = os.path.join(extracted_repo_dir, item)
-                            dst = os.path.join(extract_to, item)
-                            if os.path.exists(dst):
-                                force_delete_directory(dst)
-                            shutil.move(src, dst)
-                        
-                        force_delete_directory(extracted_repo_dir)
+            with _GH_POOL.stream(
+                'GET',
+                archive_url,
+                headers={'Accept': '*/*', **headers},
+                follow_redirects=True,
+                timeout=httpx.Timeout(60, connect=5)
+            ) as response:
+                if response.status_code != 200:
+                    print(f"Download returned HTTP {response.status_code}")
+                    continue
                 
-                try:
-                    if os.path.exists(temp_zip):
-                        os.remove(temp_zip)
-                except:
-                    pass
-                
-                return True, "Downloaded via ZIP"
+                # 'r|gz' reads the archive strictly sequentially - no seeking
+                with tarfile.open(fileobj=_StreamReader(response.iter_bytes(1 << 16)), mode='r|gz') as tar:
+                    if hasattr(tarfile, 'data_filter'):
+                        tar.extraction_filter = tarfile.data_filter
+                    for member in tar:
+                        name = member.name.partition('/')[2]
+                        if not name or not (member.isfile() or member.isdir() or member.issym()):
+                            continue
+                        # Refuse anything that would land outside the checkout
+                        target = os.path.realpath(os.path.join(root, name))
+                        if os.path.commonpath([root, target]) != root:
+                            continue
+                        if member.issym():
+                            link_target = os.path.realpath(os.path.join(os.path.dirname(target), member.linkname))
+                            if os.path.commonpath([root, link_target]) != root:
+                                continue
+                        member.name = name
+                        tar.extract(member, root)
+                    # git archive records the full commit id in the pax global header
+                    base_ref = tar.pax_headers.get('comment') or fallback_ref
             
-            if os.path.exists(temp_zip):
-                try:
-                    os.remove(temp_zip)
-                except:
-                    pass
+            return True, "Downloaded via tarball", base_ref
             
         except Exception as e:
-            print(f"Failed to download from {zip_url}: {e}")
+            print(f"Failed to download from {archive_url}: {e}")
             continue
     
-    return False, "Could not download repo as ZIP"
+    return False, "Could not download repo as tarball", None
+
+@functools.lru_cache(maxsize=128)
+def _parse_repo(repo_url):
+    """Extract owner, repo name and canonical URL from a GitHub URL
+    
+    The canonical URL has no trailing slash or .git suffix. Owner and repo
+    name are None when the URL doesn't contain both.
+    """
+    canonical_url = repo_url.rstrip('/')
+    if canonical_url.endswith('.git'):
+        canonical_url = canonical_url[:-4]
+    parts = canonical_url.split('/')
+    if len(parts) >= 2 and parts[-2] and parts[-1]:
+        return parts[-2], parts[-1], canonical_url
+    return None, None, canonical_url
 
-def get_repo_info_from_url(repo_url):
-    """Extract owner and repo name from GitHub URL"""
-    parts = repo_url.rstrip('/').replace('.git', '').split('/')
-    if len(parts) >= 2:
-        return parts[-2], parts[-1]
-    return None, None
+# Resolved GitHub logins keyed by token: {token: (resolved_at, username)}
+_USER_CACHE: Dict[str, Tuple[float, str]] = {}
+_USER_CACHE_TTL = 300
 
 def get_authenticated_user(token):
-    """Get the authenticated GitHub user from token"""
-    # Method 1: Try GitHub REST API with token
-    try:
-        import urllib.request
-        import json
-        req = urllib.request.Request(
-            'https://api.github.com/user',
-            headers={'Authorization': f'token {token}', 'Accept': 'application/vnd.github.v3+json'}
-        )
-        with urllib.request.urlopen(req, timeout=5) as response:
-            data = json.loads(response.read().decode())
-            username = data.get('login')
-            if username:
-                print(f"Successfully authenticated as: {username}")
-                return username
-    except Exception as e:
-        print(f"REST API method failed: {e}")
-        pass
+    """Get the authenticated GitHub user from token
+    
+    Results are cached per token for _USER_CACHE_TTL seconds so the lookups in
+    commit_and_push, fork_repository and the branch URL fallback of one
+    /analyze call only hit GET /user once.
+    """
+    # Expired logins are dropped on every lookup, so tokens that are never
+    # used again don't stay in memory
+    now = time.time()
+    for key, (resolved_at, _) in list(_USER_CACHE.items()):
+        if now - resolved_at >= _USER_CACHE_TTL:
+            _USER_CACHE.pop(key, None)
+    cached = _USER_CACHE.get(token)
+    if cached:
+        return cached[1]
     
-    # Method 2: Try PyGithub if available
     try:
-        from github import Github
-        g = Github(token)
-        user = g.get_user()
-        username = user.login
+        response = _GH_POOL.get('https://api.github.com/user', headers={'Authorization': f'token {token}'})
+        if response.status_code == 401:
+            _USER_CACHE.pop(token, None)
+            print("REST API method failed: token rejected (401)")
+            return None
+        response.raise_for_status()
+        username = response.json().get('login')
         if username:
             print(f"Successfully authenticated as: {username}")
+            _USER_CACHE[token] = (time.time(), username)
             return username
     except Exception as e:
-        print(f"PyGithub method failed: {e}")
+        print(f"REST API method failed: {e}")
         pass
     
     return None
 
+def _wait_for_repo(owner, repo_name, headers):
+    """Poll GET /repos/{owner}/{repo} with backoff until it answers 200"""
+    url = f"https://api.github.com/repos/{owner}/{repo_name}"
+    for delay in (0.2, 0.4, 0.8, 1.6):
+        try:
+            if _GH_POOL.get(url, headers=headers).status_code == 200:
+                return True
+        except httpx.HTTPError as e:
+            print(f"Fork poll error: {e}")
+        time.sleep(delay)
+    return False
+
 def fork_repository(original_owner, repo_name, token):
     """Fork a repository to the authenticated user's account
     
     Returns:
         tuple: (success: bool, message: str, fork_owner: str or None)
     """
+    auth_headers = {'Authorization': f'token {token}'}
     try:
-        import urllib.request
-        import json
-        
         # Get authenticated user first
         target_user = get_authenticated_user(token)
         if not target_user:
@@ -269,84 +428,86 @@ def fork_repository(original_owner, repo_name, token):
         # Check if fork already exists in user's account
         check_url = f"https://api.github.com/repos/{target_user}/{repo_name}"
         try:
-            req = urllib.request.Request(
-                check_url,
-                headers={'Authorization': f'token {token}', 'Accept': 'application/vnd.github.v3+json'}
-            )
-            with urllib.request.urlopen(req, timeout=5) as response:
+            response = _GH_POOL.get(check_url, headers=auth_headers)
+            if response.status_code == 200:
                 print(f"Fork already exists at {target_user}/{repo_name}")
                 return True, "Fork already exists", target_user
-        except urllib.error.HTTPError as e:
-            if e.code != 404:
-                return False, f"Error checking fork: {e}", None
+            if response.status_code != 404:
+                return False, f"Error checking fork: HTTP {response.status_code}", None
             # 404 means fork doesn't exist, continue to create it
-        except Exception as e:
+        except httpx.HTTPError as e:
             print(f"Check fork error: {e}")
         
         # Create the fork
         fork_url = f"https://api.github.com/repos/{original_owner}/{repo_name}/forks"
-        data = json.dumps({"owner": target_user}).encode('utf-8')
-        
-        req = urllib.request.Request(
-            fork_url,
-            data=data,
-            headers={
-                'Authorization': f'token {token}',
-                'Accept': 'application/vnd.github.v3+json',
-                'Content-Type': 'application/json'
-            },
-            method='POST'
-        )
         
         print(f"Creating fork from {original_owner}/{repo_name} to {target_user}/{repo_name}...")
-        with urllib.request.urlopen(req, timeout=30) as response:
-            fork_data = json.loads(response.read().decode())
-            print(f"Fork created successfully!")
-            import time
-            time.sleep(2)  # Wait for GitHub to finish processing fork
-            return True, f"Forked to {target_user}/{repo_name}", target_user
-            
-    except urllib.error.HTTPError as e:
-        error_body = e.read().decode() if hasattr(e, 'read') else str(e)
-        print(f"HTTP Error {e.code}: {error_body}")
-        if e.code == 422:
+        response = _GH_POOL.post(fork_url, json={"owner": target_user}, headers=auth_headers, timeout=30)
+        
+        if response.status_code == 422:
             # Repository already forked
-            target_user = get_authenticated_user(token)
+            print(f"HTTP Error 422: {response.text}")
             return True, "Repository already forked", target_user
-        return False, f"Failed to fork: {error_body}", None
+        if response.status_code >= 400:
+            print(f"HTTP Error {response.status_code}: {response.text}")
+            return False, f"Failed to fork: {response.text}", None
+        
+        print(f"Fork created successfully!")
+        # Fork creation is asynchronous on GitHub's side - wait until it is served
+        if not _wait_for_repo(target_user, repo_name, auth_headers):
+            print("Fork not visible yet, continuing anyway")
+        return True, f"Forked to {target_user}/{repo_name}", target_user
+            
     except Exception as e:
         print(f"Fork error: {e}")
         return False, f"Failed to fork: {str(e)}", None
 
-def commit_and_push(repo_dir, branch_name, token, repo_url, is_user_token=False):
+def commit_and_push(repo_dir, branch_name, token, canonical_url, clone_url, original_owner, repo_name,
+                    changed_files, base_ref=None, is_user_token=False):
     """Commit fixes and push to GitHub
     
+    Returns:
+        tuple: (branch_link or None, message, login of the token's user when
+        is_user_token, else None)
+    
     Args:
         repo_dir: Directory of the cloned repository
         branch_name: Name of the branch to create
         token: GitHub token for authentication
-        repo_url: Original repository URL
+        canonical_url: Original repository URL without trailing slash or .git
+        clone_url: Git URL (with token, if any) the sources were read from
+        original_owner: Owner parsed from the repository URL
+        repo_name: Repository name parsed from the repository URL
+        changed_files: Paths (relative to repo_dir) the agent rewrote
+        base_ref: Commit or branch the sources were downloaded from; fetched
+            as the parent commit when repo_dir has no .git (tarball download)
         is_user_token: If True, push to user's GitHub account instead of original owner
     """
-    original_owner, repo_name = get_repo_info_from_url(repo_url)
-    
     if not original_owner or not repo_name:
-        return None, "Could not parse repository info from URL"
+        return None, "Could not parse repository info from URL", None
+    
+    # The token's login is returned to the caller as well, so the branch URL
+    # fallback in analyze_repo doesn't have to resolve it again
+    user = get_authenticated_user(token) if is_user_token else None
+    
+    # Nothing to push - skip the fork and all git work
+    if not changed_files:
+        return None, "No changes to commit", user
     
     # Determine target owner based on token type
     if is_user_token:
         # Get the authenticated user's GitHub username
-        target_owner = get_authenticated_user(token)
+        target_owner = user
         if not target_owner:
             # If we can't get the username, fallback to instructing user
-            return None, "Could not authenticate with provided token. Please verify it's valid."
+            return None, "Could not authenticate with provided token. Please verify it's valid.", user
         
         # Automatically fork the repository to user's account
         print(f"\nAttempting to fork repository {original_owner}/{repo_name} to user account {target_owner}...")
         fork_success, fork_msg, fork_owner = fork_repository(original_owner, repo_name, token)
         
         if not fork_success:
-            return None, f"Failed to fork repository: {fork_msg}"
+            return None, f"Failed to fork repository: {fork_msg}", user
         
         if fork_owner:
             target_owner = fork_owner
@@ -357,51 +518,72 @@ def commit_and_push(repo_dir, branch_name, token, repo_url, is_user_token=False)
         target_owner = original_owner
         print(f"No token provided - pushing directly to original repository: {target_owner}")
     
-    # Configure git
-    run_command('git config user.email "ai-agent@rift.dev"', cwd=repo_dir)
-    run_command('git config user.name "AI Agent"', cwd=repo_dir)
-    run_command('git config init.defaultBranch main', cwd=repo_dir)
-    
-    # Wait a moment for GitHub to process the fork
-    if is_user_token:
-        print("Waiting for GitHub to process the fork...")
-        import time
-        time.sleep(3)
-    
     # Reset git remote and reinitialize if needed
     if os.path.exists(os.path.join(repo_dir, '.git')):
-        run_command('git remote remove origin', cwd=repo_dir, ignore_error=True)
+        run_command(['git', 'remote', 'remove', 'origin'], cwd=repo_dir, ignore_error=True)
     else:
-        run_command('git init', cwd=repo_dir)
-    
-    # Add the target remote
-    if token:
-        # Use token for authentication
-        push_url = f"https://{token}@github.com/{target_owner}/{repo_name}.git"
-    else:
-        # No token - use public HTTPS URL (will require credentials from git config or system)
-        push_url = f"https://github.com/{target_owner}/{repo_name}.git"
-    
-    run_command(f'git remote add origin "{push_url}"', cwd=repo_dir)
-    
-    # Checkout new branch (create if doesn't exist)
-    run_command(f'git checkout -b {branch_name}', cwd=repo_dir, ignore_error=True)
-    run_command(f'git checkout {branch_name}', cwd=repo_dir, ignore_error=True)
-    
-    # Add all changes
-    run_command('git add -A', cwd=repo_dir)
-    
-    # Check if there are changes to commit
-    result = run_command('git status --porcelain', cwd=repo_dir)
-    if not result.stdout.strip():
-        return None, "No changes to commit"
-    
-    # Commit
-    run_command('git commit -m "[AI-AGENT] Auto-fixes applied by DevOps Agent"', cwd=repo_dir)
+        # Sources came from a tarball: attach just the analyzed commit as history
+        # and point the index at it, leaving the agent's edits in the worktree.
+        # The tarball already delivered every blob, so only the commit and its
+        # trees are fetched; a mixed reset never reads blob contents
+        run_command(['git', 'init', '-q'], cwd=repo_dir)
+        fetch_result = run_command(
+            ['git', 'fetch', '--depth', '1', '--filter=blob:none', '--no-tags', clone_url, base_ref or 'HEAD'],
+            cwd=repo_dir, env=_GIT_NO_PROMPT
+        )
+        if fetch_result.returncode != 0:
+            return None, f"Could not fetch {base_ref or 'HEAD'} to commit on: {fetch_result.stderr}", user
+        run_command(['git', 'reset', '-q', 'FETCH_HEAD'], cwd=repo_dir)
+    
+    # Configure git - one append to the repo config instead of a git config
+    # subprocess per key (the clone already has its default branch)
+    with open(os.path.join(repo_dir, '.git', 'config'), 'a') as f:
+        f.write('[user]\n\temail = ai-agent@rift.dev\n\tname = AI Agent\n')
+    
+    # Add the target remote - without a token, git falls back to credentials
+    # from git config or the system
+    push_url = _git_url(target_owner, repo_name, token)
+    
+    run_command(['git', 'remote', 'add', 'origin', push_url], cwd=repo_dir)
+    
+    # Create or reset the branch and switch to it in one step
+    run_command(['git', 'switch', '-C', branch_name], cwd=repo_dir, ignore_error=True)
+    
+    # Add only the files the agent rewrote (not test-run byproducts)
+    run_command(['git', 'add', '-A', '--', *changed_files], cwd=repo_dir)
+    
+    # Check if there are changes to commit: exit 0 = nothing staged, 1 = staged changes
+    result = run_command(['git', 'diff', '--cached', '--quiet', '--', *changed_files], cwd=repo_dir, ignore_error=True)
+    if result.returncode == 0:
+        return None, "No changes to commit", user
+    if result.returncode != 1:
+        return None, f"Could not inspect staged changes: {result.stderr}", user
+    
+    # Commit with write-tree --missing-ok and commit-tree: git commit checks
+    # that every blob in the index exists, which after a blobless fetch would
+    # lazily download all the unchanged files
+    tree = run_command(['git', 'write-tree', '--missing-ok'], cwd=repo_dir).stdout.strip()
+    commit = run_command(
+        ['git', 'commit-tree', tree, '-p', 'HEAD', '-m', '[AI-AGENT] Auto-fixes applied by DevOps Agent'],
+        cwd=repo_dir
+    ).stdout.strip()
+    run_command(['git', 'update-ref', 'HEAD', commit], cwd=repo_dir)
     
     # Try to push
     print(f"Attempting to push to: {push_url}")
-    push_result = run_command(f'git push -u origin {branch_name}', cwd=repo_dir)
+    # HTTP/2 keeps ref negotiation and the pack on one connection, and the
+    # large post buffer avoids chunked-transfer renegotiation on big packs.
+    # origin was just re-added, so there is no remote-tracking ref for a bare
+    # --force-with-lease to check. The lease is taken explicitly on the branch
+    # as ls-remote sees it now (empty: it must not exist), so a rerun replaces
+    # the previous fix branch but a push landing in between is not clobbered.
+    remote_branch = run_command(['git', 'ls-remote', 'origin', f'refs/heads/{branch_name}'], cwd=repo_dir, ignore_error=True)
+    lease_sha = remote_branch.stdout.split('\t', 1)[0].strip() if remote_branch.returncode == 0 else ''
+    push_result = run_command(
+        ['git', '-c', 'http.version=HTTP/2', '-c', 'http.postBuffer=524288000',
+         'push', f'--force-with-lease=refs/heads/{branch_name}:{lease_sha}', '-u', 'origin', branch_name],
+        cwd=repo_dir
+    )
     
     if push_result.returncode == 0:
         # If push succeeded, return the appropriate link:
@@ -410,23 +592,52 @@ def commit_and_push(repo_dir, branch_name, token, repo_url, is_user_token=False)
         if is_user_token:
             branch_link = f"https://github.com/{target_owner}/{repo_name}/tree/{branch_name}"
         else:
-            branch_link = repo_url.rstrip('.git')
-        return branch_link, "Successfully pushed"
+            branch_link = canonical_url
+        return branch_link, "Successfully pushed", user
     else:
         error_msg = push_result.stderr if push_result.stderr else push_result.stdout
         print(f"Push failed with error: {error_msg}")
         
         if not token:
             # Helpful message when there's no token
-            return None, f"Push to {target_owner}/{repo_name} failed. You may need to provide GitHub credentials or a valid GitHub token. Error: {error_msg}"
+            return None, f"Push to {target_owner}/{repo_name} failed. You may need to provide GitHub credentials or a valid GitHub token. Error: {error_msg}", user
         
         # Check if it's a permission/existence error
         if "404" in error_msg or "not found" in error_msg:
-            return None, f"Repository not found in {target_owner}'s account. Please fork the repository first: https://github.com/{original_owner}/{repo_name}/fork"
+            return None, f"Repository not found in {target_owner}'s account. Please fork the repository first: https://github.com/{original_owner}/{repo_name}/fork", user
         elif "Permission denied" in error_msg or "403" in error_msg:
-            return None, f"Permission denied. Make sure your token has push access to {target_owner}/{repo_name}"
+            return None, f"Permission denied. Make sure your token has push access to {target_owner}/{repo_name}", user
         else:
-            return None, f"Push failed: {error_msg}"
+            return None, f"Push failed: {error_msg}", user
+
+# core.longpaths is a global, idempotent setting - write it once per process
+_GIT_CONFIGURED = False
+
+@app.on_event("startup")
+def configure_git():
+    global _GIT_CONFIGURED
+    if not _GIT_CONFIGURED:
+        run_command(['git', 'config', '--global', 'core.longpaths', 'true'], ignore_error=True)
+        _GIT_CONFIGURED = True
+
+# Checkouts live under temp_repos/; every /analyze removes its own checkout
+# when it finishes, so only dirs of in-flight requests are tracked here
+_TEMP_DIR = os.path.join(os.getcwd(), "temp_repos")
+_ACTIVE = set()
+
+# One results file per run, so concurrent requests never overwrite each other
+_RESULTS_DIR = os.path.join(os.getcwd(), "results")
+
+def _write_results(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+
+@app.on_event("startup")
+def reset_temp_dir():
+    """Clear checkouts left behind by a crashed or killed previous process"""
+    shutil.rmtree(_TEMP_DIR, onerror=lambda func, path, exc_info: None)
+    os.makedirs(_TEMP_DIR, exist_ok=True)
 
 @app.get("/")
 def read_root():
@@ -480,7 +691,7 @@ def health_check():
     }
 
 @app.post("/analyze")
-async def analyze_repo(req: AnalyzeRequest):
+async def analyze_repo(req: AnalyzeRequest, background_tasks: BackgroundTasks):
     start_time = time.time()
     
     # Validate inputs
@@ -506,140 +717,138 @@ async def analyze_repo(req: AnalyzeRequest):
     print(f"Using: {token_source}")
     
     # Branch name format: TEAM_NAME_LEADER_AI_Fix
-    branch_name = f"{req.team_name.upper().replace(' ', '_')}_{req.leader_name.upper().replace(' ', '_')}_AI_Fix"
+    branch_name = f"{branch_name_part(req.team_name)}_{branch_name_part(req.leader_name)}_AI_Fix"
     
-    # Repository setup
-    repo_name = req.repo_url.split("/")[-1].replace(".git", "")
-    repo_name = sanitize_filename(repo_name)
+    # Repository setup - parse owner/name once for clone, push and the branch URL
+    repo_owner, repo_name, canonical_url = _parse_repo(req.repo_url)
+    dir_name = sanitize_filename(repo_name or "")
+    # Git URL for reading the original repo, shared by the clone and the push path
+    clone_url = _git_url(repo_owner, repo_name, github_token, req.repo_url) if repo_owner else None
     
-    temp_dir = os.path.join(os.getcwd(), "temp_repos")
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    # Use unique directory name
+    # Use unique directory name (leftovers of earlier runs are cleared at startup)
     timestamp = int(time.time())
-    clone_dir = os.path.join(temp_dir, f"{repo_name}_{timestamp}")
+    clone_dir = os.path.join(_TEMP_DIR, f"{dir_name}_{timestamp}")
+    while clone_dir in _ACTIVE:
+        timestamp += 1
+        clone_dir = os.path.join(_TEMP_DIR, f"{dir_name}_{timestamp}")
     
-    # Clean previous runs
+    _ACTIVE.add(clone_dir)
     try:
-        for item in os.listdir(temp_dir):
-            item_path = os.path.join(temp_dir, item)
-            if os.path.isdir(item_path) and item.startswith(repo_name):
-                force_delete_directory(item_path)
-    except:
-        pass
-    
-    print(f"Downloading {req.repo_url} to {clone_dir}...")
-    
-    # Configure git
-    run_command("git config --global core.longpaths true")
-    
-    # Try cloning with token
-    success = False
-    message = ""
-    
-    success, message = clone_with_token(req.repo_url, clone_dir, github_token)
-    
-    # Fallback to ZIP download
-    if not success:
-        print("Git clone failed, trying ZIP download...")
-        success, message = download_and_extract_zip(req.repo_url, clone_dir, github_token)
-    
-    if not success:
-        raise HTTPException(status_code=400, detail=f"Failed to download repository: {message}")
-    
-    if not os.path.exists(clone_dir):
-        raise HTTPException(status_code=400, detail="Download failed - directory not created")
-    
-    try:
-        files = [f for f in os.listdir(clone_dir) if not f.startswith('.')]
-        if not files:
-            raise HTTPException(status_code=400, detail="Repository is empty")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error accessing repository: {str(e)}")
-    
-    # Run the Agent with GitHub token for CI/CD validation
-    try:
-        print(f"Executing agent with max_iterations: {max_iterations}")
-        agent = CodeAgent(clone_dir, github_token=github_token)
-        agent_result = agent.execute(max_iterations=max_iterations)
-        print(f"Agent execution completed with {agent_result.get('total_iterations', 0)} iterations")
-    except Exception as e:
-        print(f"Agent error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Agent execution failed: {str(e)}")
-    
-    # Commit and Push to GitHub
-    # Commit and Push to GitHub
-    branch_url = None
-    push_status = "Not pushed"
-    
-    # Always try to push (with token if available, or with public URL if not)
-    print(f"Attempting to push branch to GitHub repository...")
-    push_url, push_msg = commit_and_push(clone_dir, branch_name, github_token, req.repo_url, is_user_token=is_user_token)
-    if push_url:
-        branch_url = push_url
-        push_status = "Pushed successfully"
-        if is_user_token:
-            print(f"Branch pushed to user's GitHub: {push_url}")
-        else:
-            print(f"Branch pushed to repository: {push_url}")
-    else:
-        push_status = f"Push failed: {push_msg}"
-        print(f"Push failed: {push_msg}")
-    
-    # If no branch_url was created, generate the expected URL
-    if not branch_url:
-        repo_owner, repo_name = get_repo_info_from_url(req.repo_url)
-        if repo_owner and repo_name:
-            # If user token was provided, generate URL for user's account
+        print(f"Downloading {req.repo_url} to {clone_dir}...")
+        
+        # Stream the sources as a tarball - git history is only needed to push
+        success, message, base_ref = await asyncio.to_thread(
+            download_and_extract_tarball, canonical_url, clone_dir, github_token, repo_owner, repo_name
+        )
+        
+        # Fallback to cloning with token
+        if not success:
+            print("Tarball download failed, trying git clone...")
+            await asyncio.to_thread(force_delete_directory, clone_dir)
+            success, message = await clone_with_token(clone_url, clone_dir)
+        
+        if not success:
+            raise HTTPException(status_code=400, detail=f"Failed to download repository: {message}")
+        
+        if not os.path.exists(clone_dir):
+            raise HTTPException(status_code=400, detail="Download failed - directory not created")
+        
+        try:
+            files = [f for f in os.listdir(clone_dir) if not f.startswith('.')]
+            if not files:
+                raise HTTPException(status_code=400, detail="Repository is empty")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error accessing repository: {str(e)}")
+        
+        # Run the Agent with GitHub token for CI/CD validation
+        try:
+            print(f"Executing agent with max_iterations: {max_iterations}")
+            agent = CodeAgent(clone_dir, github_token=github_token)
+            agent_result = await asyncio.to_thread(agent.execute, max_iterations=max_iterations)
+            print(f"Agent execution completed with {agent_result.get('total_iterations', 0)} iterations")
+        except Exception as e:
+            print(f"Agent error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Agent execution failed: {str(e)}")
+        
+        # Commit and Push to GitHub
+        branch_url = None
+        push_status = "Not pushed"
+        
+        # Always try to push (with token if available, or with public URL if not)
+        print(f"Attempting to push branch to GitHub repository...")
+        changed_files = sorted({
+            fix['file'] for fix in agent_result.get('fixes', []) if fix.get('status') == 'Fixed'
+        })
+        push_url, push_msg, token_user = await asyncio.to_thread(
+            commit_and_push, clone_dir, branch_name, github_token, canonical_url, clone_url, repo_owner, repo_name,
+            changed_files, base_ref=base_ref, is_user_token=is_user_token
+        )
+        if push_url:
+            branch_url = push_url
+            push_status = "Pushed successfully"
             if is_user_token:
-                target_owner = get_authenticated_user(github_token)
-                if target_owner:
-                    branch_url = f"https://github.com/{target_owner}/{repo_name}/tree/{branch_name}"
-                else:
-                    branch_url = f"https://github.com/{repo_owner}/{repo_name}/tree/{branch_name}"
+                print(f"Branch pushed to user's GitHub: {push_url}")
             else:
-                # No user token — show the original repository input link
-                branch_url = req.repo_url.rstrip('.git')
+                print(f"Branch pushed to repository: {push_url}")
         else:
-            branch_url = f"{req.repo_url.rstrip('.git')}/tree/{branch_name}"
-    
-    # Prepare Response
-    duration = round(time.time() - start_time, 2)
-    
-    cicd_status = "PASSED"
-    if agent_result.get('cicd_runs'):
-        cicd_status = agent_result['cicd_runs'][-1].get('status', 'PASSED')
-    
-    result_data = {
-        "repo_url": req.repo_url,
-        "team_name": req.team_name,
-        "leader_name": req.leader_name,
-        "branch_name": branch_name,
-        "branch_url": branch_url,  # Link to the pushed branch on GitHub
-        "push_status": push_status,
-        "token_used": token_source,  # Shows which token was used
-        "push_destination": "User's GitHub Account (Forked)" if is_user_token else "Original Repository",
-        "max_iterations_used": max_iterations,  # Number of iterations available
-        "total_failures_detected": agent_result.get('unique_bugs', 0),
-        "total_fixes_applied": len(agent_result.get('fixes', [])),
-        "cicd_status": cicd_status,
-        "total_time_taken": duration,
-        "total_iterations": agent_result.get('total_iterations', 1),
-        "fixes": agent_result.get('fixes', []),
-        "cicd_runs": agent_result.get('cicd_runs', [])
-    }
-    
-    # Save results.json
-    with open("results.json", "w") as f:
-        json.dump(result_data, f, indent=2)
-    
-    # Cleanup
-    try:
-        force_delete_directory(clone_dir)
-    except Exception as e:
-        print(f"Cleanup warning: {e}")
-    
-    return result_data
+            push_status = f"Push failed: {push_msg}"
+            print(f"Push failed: {push_msg}")
+        
+        # If no branch_url was created, generate the expected URL
+        if not branch_url:
+            if repo_owner and repo_name:
+                # If user token was provided, generate URL for user's account
+                # (login as already resolved by commit_and_push)
+                if is_user_token:
+                    if token_user:
+                        branch_url = f"https://github.com/{token_user}/{repo_name}/tree/{branch_name}"
+                    else:
+                        branch_url = f"https://github.com/{repo_owner}/{repo_name}/tree/{branch_name}"
+                else:
+                    # No user token — show the original repository input link
+                    branch_url = canonical_url
+            else:
+                branch_url = f"{canonical_url}/tree/{branch_name}"
+        
+        # Prepare Response
+        duration = round(time.time() - start_time, 2)
+        
+        cicd_status = "PASSED"
+        if agent_result.get('cicd_runs'):
+            cicd_status = agent_result['cicd_runs'][-1].get('status', 'PASSED')
+        
+        result_data = {
+            "repo_url": req.repo_url,
+            "team_name": req.team_name,
+            "leader_name": req.leader_name,
+            "branch_name": branch_name,
+            "branch_url": branch_url,  # Link to the pushed branch on GitHub
+            "push_status": push_status,
+            "token_used": token_source,  # Shows which token was used
+            "push_destination": "User's GitHub Account (Forked)" if is_user_token else "Original Repository",
+            "max_iterations_used": max_iterations,  # Number of iterations available
+            "total_failures_detected": agent_result.get('unique_bugs', 0),
+            "total_fixes_applied": len(agent_result.get('fixes', [])),
+            "cicd_status": cicd_status,
+            "total_time_taken": duration,
+            "total_iterations": agent_result.get('total_iterations', 1),
+            "fixes": agent_result.get('fixes', []),
+            "cicd_runs": agent_result.get('cicd_runs', [])
+        }
+        
+        # Save results/<repo>_<timestamp>.json after the response is sent
+        background_tasks.add_task(
+            _write_results, os.path.join(_RESULTS_DIR, os.path.basename(clone_dir) + ".json"), result_data
+        )
+        
+        return result_data
+    finally:
+        # Cleanup
+        try:
+            await asyncio.to_thread(force_delete_directory, clone_dir)
+        except Exception as e:
+            print(f"Cleanup warning: {e}")
+        _ACTIVE.discard(clone_dir)
 
 if __name__ == "__main__":
     import uvicorn